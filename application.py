@@ -2,32 +2,36 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
-from starlette.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from starlette.status import HTTP_422_UNPROCESSABLE_ENTITY
 
-from src.core.settings import settings
+from src.core.settings import close_redis, settings
 from src.embedding import routers as embedding_routers
 from src.auth import routers as auth_routers
-from src.embedding.vector_db import create_collection
-import nltk
+from src.health import routers as health_routers
+from src.embedding.services import load_text_resources
+from src.embedding.vector_db import create_collection, close_vector_store
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await create_collection(vector_size=settings.QDRANT_VECTOR_SIZE)
-    nltk.download("punkt_tab", download_dir=settings.NLTK_DATA_DIR)
+    load_text_resources()
     yield
+    await close_vector_store()
+    await close_redis()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(embedding_routers.router, prefix="/api/v1/embedding", tags=["embedding"])
 app.include_router(auth_routers.router, prefix="/api/v1/auth", tags=["auth"])
+app.include_router(health_routers.router, prefix="/health", tags=["health"])
 
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     errors = [{"field": err["loc"][-1], "msg": err["msg"]} for err in exc.errors()]
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=HTTP_422_UNPROCESSABLE_ENTITY,
         content={"detail": errors},
     )
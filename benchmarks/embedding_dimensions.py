@@ -0,0 +1,94 @@
+"""
+Measure the recall lost by storing reduced-dimension embeddings on a local labeled query set.
+
+The corpus and queries are embedded once at the full model dimension. Every smaller dimension is then
+derived by truncation and re-normalization, which is what the API returns for `text-embedding-3-*`
+when `dimensions` is sent.
+
+Input files are JSON lines:
+    corpus:  {"id": "doc-1", "text": "..."}
+    queries: {"query": "...", "relevant": ["doc-1", "doc-7"]}
+
+Usage:
+    python -m benchmarks.embedding_dimensions --corpus corpus.jsonl --queries queries.jsonl --dimensions 256,512,1536
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from src.clients.azure_openai import embedding_client
+from src.core.constants import EMBEDDING_MODEL_DIMENSIONS, INGEST_BATCH_SIZE
+from src.core.settings import settings
+from src.embedding.services import create_text_embeddings
+from src.embedding.utils import truncate_embeddings
+
+
+def read_jsonl(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def embed(texts: list[str], dimensions: int) -> list[list[float]]:
+    embeddings = []
+    for start in range(0, len(texts), INGEST_BATCH_SIZE):
+        response = await create_text_embeddings(embedding_client, texts[start : start + INGEST_BATCH_SIZE], dimensions)
+        embeddings.extend([item.embedding for item in response.data])
+
+    return embeddings
+
+
+def top_k(query_vectors: np.ndarray, corpus_vectors: np.ndarray, k: int) -> np.ndarray:
+    scores = query_vectors @ corpus_vectors.T
+    candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, candidates, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", required=True)
+    parser.add_argument("--queries", required=True)
+    parser.add_argument("--dimensions", default="256,512,768,1024,1536")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--full-dimensions", type=int, default=EMBEDDING_MODEL_DIMENSIONS.get(settings.AZURE_OPENAI_MODEL_NAME, 1536)
+    )
+    args = parser.parse_args()
+
+    corpus = read_jsonl(args.corpus)
+    queries = read_jsonl(args.queries)
+    doc_ids = [doc["id"] for doc in corpus]
+    k = min(args.k, len(corpus))
+
+    full_corpus = await embed([doc["text"] for doc in corpus], args.full_dimensions)
+    full_queries = await embed([query["query"] for query in queries], args.full_dimensions)
+    full_top_k = top_k(np.asarray(full_queries, dtype=np.float32), np.asarray(full_corpus, dtype=np.float32), k)
+
+    print(f"{'dims':>6} {'recall@' + str(k):>10} {'overlap':>8} {'MB/1M vectors':>14} {'search ms':>10}")
+    for dimensions in sorted(int(d) for d in args.dimensions.split(",")):
+        corpus_vectors = np.asarray(truncate_embeddings(full_corpus, dimensions), dtype=np.float32)
+        query_vectors = np.asarray(truncate_embeddings(full_queries, dimensions), dtype=np.float32)
+
+        started = time.perf_counter()
+        results = top_k(query_vectors, corpus_vectors, k)
+        search_ms = (time.perf_counter() - started) * 1000
+
+        recall, overlap = [], []
+        for query, hits, full_hits in zip(queries, results, full_top_k):
+            relevant = set(query["relevant"])
+            retrieved = {doc_ids[i] for i in hits}
+            recall.append(len(relevant & retrieved) / len(relevant) if relevant else 1.0)
+            overlap.append(len(set(hits) & set(full_hits)) / k)
+
+        print(
+            f"{dimensions:>6} {np.mean(recall):>10.3f} {np.mean(overlap):>8.3f} "
+            f"{dimensions * 4 * 1_000_000 / 2**20:>14.0f} {search_ms:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Compare REST and gRPC transports of the Qdrant client for bulk upsert and search.
+
+Usage:
+    python -m benchmarks.qdrant_transport --points 20000 --batch-size 256 --queries 500
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from src.clients.qdrant import create_qdrant_client
+from src.core.settings import settings
+
+
+def random_vector(size: int) -> list[float]:
+    return [random.uniform(-1.0, 1.0) for _ in range(size)]
+
+
+async def run_transport(prefer_grpc: bool, points: int, batch_size: int, queries: int, vector_size: int) -> dict:
+    client = create_qdrant_client(prefer_grpc=prefer_grpc)
+    collection_name = f"benchmark_{uuid.uuid4().hex[:8]}"
+
+    await client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+    )
+
+    try:
+        batches = [
+            [
+                PointStruct(id=str(uuid.uuid4()), vector=random_vector(vector_size), payload={"user_id": "benchmark"})
+                for _ in range(min(batch_size, points - start))
+            ]
+            for start in range(0, points, batch_size)
+        ]
+        query_vectors = [random_vector(vector_size) for _ in range(queries)]
+
+        started = time.perf_counter()
+        for batch in batches:
+            await client.upsert(collection_name=collection_name, points=batch, wait=True)
+        upsert_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for vector in query_vectors:
+            await client.search(collection_name=collection_name, query_vector=vector, limit=5, with_payload=True)
+        search_seconds = time.perf_counter() - started
+    finally:
+        await client.delete_collection(collection_name)
+        await client.close()
+
+    return {
+        "transport": "grpc" if prefer_grpc else "rest",
+        "upsert_points_per_s": points / upsert_seconds,
+        "search_ms_per_query": search_seconds / queries * 1000,
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--vector-size", type=int, default=settings.QDRANT_VECTOR_SIZE)
+    args = parser.parse_args()
+
+    print(f"{'transport':<10} {'upsert points/s':>16} {'search ms/query':>16}")
+    for prefer_grpc in (False, True):
+        result = await run_transport(prefer_grpc, args.points, args.batch_size, args.queries, args.vector_size)
+        print(
+            f"{result['transport']:<10} {result['upsert_points_per_s']:>16.1f} {result['search_ms_per_query']:>16.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
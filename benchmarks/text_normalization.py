@@ -0,0 +1,132 @@
+"""
+Measure the CPU time spent normalizing the text of an ingest before and after single-pass cleaning.
+
+The legacy path cleaned every PDF page and then every chunk again, each time with two `re.sub` passes and
+a synchronous INFO log record. The current path cleans every page once with one compiled pattern and logs
+at DEBUG. Chunking is done once up front and is not part of the measurement.
+
+Without PDFs a synthetic document of `--pages` pages is used.
+
+Usage:
+    python -m benchmarks.text_normalization --pdf report.pdf --repeat 5
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import string
+import time
+
+from src.embedding.services import SentenceAwareChunker, TextExtractorService, get_tokenizer, load_text_resources
+
+legacy_logger = logging.getLogger("benchmarks.text_normalization.legacy")
+
+
+def legacy_clean_text(text: str) -> str:
+    cleaned = re.sub(r"[\n\r\t\b]", " ", text)
+    cleaned = re.sub(r"\s+", " ", cleaned)
+    cleaned = cleaned.strip()
+
+    legacy_logger.info(f"Cleaning text from {len(cleaned)} characters")
+    return cleaned
+
+
+def synthetic_pages(pages: int, words_per_page: int = 600) -> dict[int, str]:
+    random_generator = random.Random(0)
+    separators = [" ", " ", " ", "  ", "\n", "\t", ". ", ".\n\n", "\r\n"]
+
+    page_texts = {}
+    for page_number in range(1, pages + 1):
+        words = []
+        for _ in range(words_per_page):
+            length = random_generator.randint(2, 10)
+            words.append("".join(random_generator.choices(string.ascii_lowercase, k=length)))
+            words.append(random_generator.choice(separators))
+        page_texts[page_number] = "".join(words)
+
+    return page_texts
+
+
+def read_pdf_pages(paths: list[str]) -> dict[str, str]:
+    page_texts = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            for page_number, text in TextExtractorService._read_pdf_pages(f.read()).items():
+                page_texts[f"{os.path.basename(path)}:{page_number}"] = text
+
+    return page_texts
+
+
+async def chunk_pages(page_texts: dict, max_tokens: int) -> list[str]:
+    chunker = SentenceAwareChunker(get_tokenizer(), max_tokens)
+    chunks = []
+    for text in page_texts.values():
+        chunks.extend(await chunker.chunk_text(legacy_clean_text(text)))
+
+    return chunks
+
+
+def run_legacy(page_texts: dict, chunks: list[str]) -> None:
+    for text in page_texts.values():
+        legacy_clean_text(text)
+    for chunk in chunks:
+        legacy_clean_text(chunk)
+
+
+def run_current(page_texts: dict) -> None:
+    for text in page_texts.values():
+        # clean_text never suspends, stepping the coroutine once keeps event loop overhead out of the timing
+        try:
+            TextExtractorService.clean_text(text).send(None)
+        except StopIteration:
+            pass
+
+
+def measure(run, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started_at = time.process_time()
+        run()
+        timings.append(time.process_time() - started_at)
+
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", nargs="*", default=[], help="PDF files to extract the pages from")
+    parser.add_argument("--pages", type=int, default=500, help="Pages of the synthetic document")
+    parser.add_argument("--max-tokens", type=int, default=50, help="Chunk size used by the ingest endpoint")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path, the fastest is reported")
+    args = parser.parse_args()
+
+    load_text_resources()
+    page_texts = read_pdf_pages(args.pdf) if args.pdf else synthetic_pages(args.pages)
+    chunks = asyncio.run(chunk_pages(page_texts, args.max_tokens))
+
+    # The legacy setup wrote every INFO record synchronously from the request thread
+    with open(os.devnull, "w") as devnull:
+        handler = logging.StreamHandler(devnull)
+        handler.setFormatter(logging.Formatter("%(levelname)s: %(message)s"))
+        legacy_logger.addHandler(handler)
+        legacy_logger.setLevel(logging.INFO)
+        legacy_logger.propagate = False
+
+        legacy = measure(lambda: run_legacy(page_texts, chunks), args.repeat)
+
+    logging.getLogger("src.core.settings").setLevel(logging.INFO)
+    current = measure(lambda: run_current(page_texts), args.repeat)
+
+    characters = sum(len(text) for text in page_texts.values())
+    print(f"{len(page_texts)} pages, {len(chunks)} chunks, {characters} characters")
+    print(f"{'path':<8} {'cpu_ms':>10} {'clean_calls':>12}")
+    print(f"{'legacy':<8} {legacy * 1000:>10.1f} {len(page_texts) + len(chunks):>12}")
+    print(f"{'current':<8} {current * 1000:>10.1f} {len(page_texts):>12}")
+    print(f"CPU saved: {(1 - current / legacy) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Production launcher: a gunicorn master managing uvicorn workers.
+
+The application and its heavy dependencies (PyMuPDF, python-docx, NLTK and the tiktoken tokenizer) are loaded
+once in the master before the workers are forked, so the workers start instantly and share those pages
+copy-on-write instead of each loading its own copy.
+
+Run with `python server.py`.
+"""
+
+import os
+import resource
+import time
+
+STARTED_AT = time.perf_counter()
+
+from gunicorn.app.base import BaseApplication  # noqa: E402
+
+from src.core.settings import logger, settings, start_log_listener  # noqa: E402
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return load_application()
+
+
+def load_application():
+    """Import the application and load the text resources, in the master when `preload_app` is set."""
+
+    started_at = time.perf_counter()
+
+    from application import app
+    from src.embedding.services import load_text_resources
+
+    load_text_resources()
+
+    logger.info(f"Application loaded in {time.perf_counter() - started_at:.2f}s ({format_memory_usage(os.getpid())})")
+    return app
+
+
+def get_memory_usage(pid: int) -> dict[str, int]:
+    """
+    Resident (`Rss`), proportional (`Pss`) and shared memory of a process in KiB.
+
+    `Pss` splits every shared page between the processes mapping it, so it is the footprint a worker adds.
+    Where `/proc` is not available only the peak resident memory of the current process is known.
+    """
+
+    usage = {"Rss": 0, "Pss": 0, "Shared": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    usage[key] = int(value.split()[0])
+                elif key in ("Shared_Clean", "Shared_Dirty"):
+                    usage["Shared"] += int(value.split()[0])
+    except OSError:
+        usage["Rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return usage
+
+
+def format_memory_usage(pid: int) -> str:
+    usage = get_memory_usage(pid)
+    return ", ".join(f"{key.lower()}={value / 1024:.1f}MiB" for key, value in usage.items())
+
+
+def post_fork(server, worker) -> None:
+    start_log_listener()
+
+
+def when_ready(server) -> None:
+    logger.info(f"Server ready in {time.perf_counter() - STARTED_AT:.2f}s with {server.num_workers} workers")
+
+
+def post_worker_init(worker) -> None:
+    logger.info(f"Worker {worker.pid} booted ({format_memory_usage(worker.pid)})")
+
+
+def worker_exit(server, worker) -> None:
+    logger.info(f"Worker {worker.pid} exited ({format_memory_usage(worker.pid)})")
+
+
+def get_worker_count() -> int:
+    """Configured number of workers, one per available CPU core by default."""
+
+    if settings.SERVER_WORKERS > 0:
+        return settings.SERVER_WORKERS
+
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def get_server_options() -> dict:
+    return {
+        "bind": f"0.0.0.0:{settings.PORT}",
+        "workers": get_worker_count(),
+        "worker_class": "uvicorn_worker.UvicornWorker",
+        "preload_app": True,
+        "timeout": settings.SERVER_TIMEOUT,
+        # On SIGTERM workers stop accepting connections and get this long to finish in-flight requests
+        "graceful_timeout": settings.SERVER_GRACEFUL_TIMEOUT,
+        "keepalive": settings.SERVER_KEEPALIVE,
+        "accesslog": "-",
+        "post_fork": post_fork,
+        "when_ready": when_ready,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+    }
+
+
+if __name__ == "__main__":
+    Server(get_server_options()).run()
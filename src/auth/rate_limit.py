@@ -0,0 +1,187 @@
+import math
+import time
+from typing import NamedTuple
+
+from fastapi import Depends, HTTPException
+from redis.exceptions import RedisError
+
+from src.auth.utils import get_current_user
+from src.core.constants import INGEST_SLOT_AGE
+from src.core.settings import logger, settings, get_redis
+
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * refill_rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / refill_rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return tostring(retry_after)
+"""
+
+
+class RateBudget(NamedTuple):
+    name: str
+    capacity: float
+    refill_rate: float
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0 and self.refill_rate > 0
+
+
+SEARCH_BUDGET = RateBudget("search", settings.RATE_LIMIT_SEARCH_BURST, settings.RATE_LIMIT_SEARCH_PER_SECOND)
+INGEST_CHUNKS_BUDGET = RateBudget(
+    "ingest_chunks", settings.RATE_LIMIT_INGEST_CHUNKS_PER_MINUTE, settings.RATE_LIMIT_INGEST_CHUNKS_PER_MINUTE / 60
+)
+INGEST_TOKENS_BUDGET = RateBudget(
+    "ingest_tokens", settings.RATE_LIMIT_INGEST_TOKENS_PER_MINUTE, settings.RATE_LIMIT_INGEST_TOKENS_PER_MINUTE / 60
+)
+
+
+class InMemoryTokenBucket:
+    """Process local token buckets, used when Redis is unavailable."""
+
+    def __init__(self):
+        self._buckets = {}
+
+    def consume(self, key: str, budget: RateBudget, cost: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (budget.capacity, now))
+        tokens = min(budget.capacity, tokens + (now - updated_at) * budget.refill_rate)
+
+        retry_after = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            retry_after = (cost - tokens) / budget.refill_rate
+
+        self._buckets[key] = (tokens, now)
+        return retry_after
+
+
+local_buckets = InMemoryTokenBucket()
+local_slots = {}
+
+
+class RateLimiter:
+    """
+    Per-user admission control backed by Redis token buckets and in-flight counters.
+
+    Every check fails fast with a 429 and a `Retry-After` header instead of queueing the request.
+    When Redis is unreachable the limits are enforced per process.
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._token_bucket = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def consume(self, user_id: str, budget: RateBudget, cost: float = 1) -> None:
+        if not budget.enabled or cost <= 0:
+            return
+
+        if cost > budget.capacity:
+            raise HTTPException(
+                status_code=413, detail=f"Request exceeds the {budget.name} budget of {int(budget.capacity)}"
+            )
+
+        key = f"user:{user_id}:rate:{budget.name}"
+        try:
+            retry_after = float(
+                await self._token_bucket(keys=[key], args=[budget.capacity, budget.refill_rate, cost, time.time()])
+            )
+        except RedisError as e:
+            logger.warning(f"Rate limiter falling back to in-memory buckets: {str(e)}")
+            retry_after = local_buckets.consume(key, budget, cost)
+
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit exceeded for {budget.name}",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+    async def consume_ingest(self, user_id: str, chunks: int, tokens: int) -> None:
+        await self.consume(user_id, INGEST_CHUNKS_BUDGET, chunks)
+        await self.consume(user_id, INGEST_TOKENS_BUDGET, tokens)
+
+    async def acquire_slot(self, user_id: str, scope: str, limit: int) -> bool:
+        """
+        Reserve one of the user's concurrent request slots.
+
+        :return: `True` if the slot was reserved in process memory because Redis is unavailable.
+        :raises HTTPException: 429 if all slots are taken.
+        """
+
+        key = f"user:{user_id}:inflight:{scope}"
+        try:
+            in_flight = await self.redis.incr(key)
+            await self.redis.expire(key, INGEST_SLOT_AGE)
+            if in_flight > limit:
+                await self.redis.decr(key)
+                self._reject_slot(scope)
+            return False
+        except RedisError as e:
+            logger.warning(f"Rate limiter falling back to in-memory slots: {str(e)}")
+
+        if local_slots.get(key, 0) >= limit:
+            self._reject_slot(scope)
+
+        local_slots[key] = local_slots.get(key, 0) + 1
+        return True
+
+    async def release_slot(self, user_id: str, scope: str, is_local: bool) -> None:
+        key = f"user:{user_id}:inflight:{scope}"
+        if is_local:
+            local_slots[key] = max(local_slots.get(key, 1) - 1, 0)
+            return
+
+        try:
+            await self.redis.decr(key)
+        except RedisError as e:
+            logger.warning(f"Failed to release {scope} slot: {str(e)}")
+
+    @staticmethod
+    def _reject_slot(scope: str) -> None:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many concurrent {scope} requests",
+            headers={"Retry-After": "1"},
+        )
+
+
+async def search_admission(auth_payload: dict = Depends(get_current_user), redis=Depends(get_redis)) -> None:
+    """Charge one search request against the user's search budget."""
+
+    user_id = auth_payload.get("user").get("sub")
+    await RateLimiter(redis).consume(user_id, SEARCH_BUDGET)
+
+
+async def ingest_admission(auth_payload: dict = Depends(get_current_user), redis=Depends(get_redis)):
+    """Hold one of the user's ingest slots for the duration of the request."""
+
+    user_id = auth_payload.get("user").get("sub")
+    rate_limiter = RateLimiter(redis)
+
+    if not settings.RATE_LIMIT_INGEST_CONCURRENCY:
+        yield rate_limiter
+        return
+
+    is_local = await rate_limiter.acquire_slot(user_id, "ingest", settings.RATE_LIMIT_INGEST_CONCURRENCY)
+    try:
+        yield rate_limiter
+    finally:
+        await rate_limiter.release_slot(user_id, "ingest", is_local)
@@ -1,7 +1,50 @@
+import httpx
+from grpc import Compression
 from qdrant_client import AsyncQdrantClient
 
+from src.core.constants import QDRANT_GRPC_MAX_MESSAGE_LENGTH
 from src.core.settings import settings
 
-client = AsyncQdrantClient(
-    host=settings.QDRANT_HOST, port=settings.QDRANT_HTTP_PORT, grpc_port=settings.QDRANT_GRPC_PORT
-)
+# The Qdrant client only accepts gzip, deflate is rejected when the client is created
+GRPC_COMPRESSION = {"gzip": Compression.Gzip, "none": None}
+
+
+def get_grpc_compression(name: str) -> Compression | None:
+    """Map the configured gRPC compression to its gRPC value, `None` when compression is disabled."""
+
+    if name not in GRPC_COMPRESSION:
+        raise ValueError(f"Unknown Qdrant gRPC compression: {name}, expected one of {', '.join(GRPC_COMPRESSION)}")
+
+    return GRPC_COMPRESSION[name]
+
+
+def create_qdrant_client(prefer_grpc: bool = settings.QDRANT_USE_GRPC) -> AsyncQdrantClient:
+    """
+    Create a Qdrant client configured from the settings.
+
+    :param prefer_grpc: Use gRPC instead of REST for the operations that support it.
+    :return: AsyncQdrantClient instance.
+    """
+
+    grpc_options = {
+        "grpc.max_send_message_length": QDRANT_GRPC_MAX_MESSAGE_LENGTH,
+        "grpc.max_receive_message_length": QDRANT_GRPC_MAX_MESSAGE_LENGTH,
+        "grpc.keepalive_time_ms": settings.QDRANT_GRPC_KEEPALIVE_MS,
+    }
+
+    return AsyncQdrantClient(
+        host=settings.QDRANT_HOST,
+        port=int(settings.QDRANT_HTTP_PORT),
+        grpc_port=int(settings.QDRANT_GRPC_PORT),
+        prefer_grpc=prefer_grpc,
+        timeout=settings.QDRANT_TIMEOUT,
+        grpc_options=grpc_options,
+        grpc_compression=get_grpc_compression(settings.QDRANT_GRPC_COMPRESSION),
+        limits=httpx.Limits(
+            max_connections=settings.QDRANT_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.QDRANT_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+
+
+client = create_qdrant_client()
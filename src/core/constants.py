@@ -1 +1,67 @@
+import uuid
+
 SESSION_AGE = 60 * 60 * 24 * 30  # 30 days
+
+POINT_ID_NAMESPACE = uuid.UUID("6f1c7a52-3f0e-4d55-9a36-0f4b8c2d9e17")
+MAX_CONTEXT_WINDOW = 5
+
+INGEST_BATCH_SIZE = 64
+INGEST_CHECKPOINT_AGE = 60 * 60 * 24  # 1 day
+IDEMPOTENCY_KEY_AGE = 60 * 60 * 24  # 1 day
+IDEMPOTENCY_PENDING = "pending"
+
+POINT_COUNT_CACHE_AGE = 60 * 5  # 5 minutes
+OPTIMIZER_DELETED_THRESHOLD = 0.05
+OPTIMIZER_VACUUM_MIN_VECTORS = 100
+
+TENANCY_SHARED = "shared"
+TENANCY_SHARD_KEY = "shard_key"
+TENANCY_PER_TENANT = "per_tenant"
+TENANCY_MIGRATION_BATCH_SIZE = 256
+
+QDRANT_GRPC_MAX_MESSAGE_LENGTH = 64 * 1024 * 1024  # 64 MB
+
+INGEST_SLOT_AGE = 60 * 10  # 10 minutes
+
+EMBEDDING_MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+# Document ids are the leading 32 hex digits of the SHA-256 of the content, see `get_document_id`
+DOCUMENT_ID_PATTERN = r"^[0-9a-f]{32}$"
+
+# Models trained so their embeddings can be shortened, the others only work at full dimension
+MATRYOSHKA_EMBEDDING_MODELS = {"text-embedding-3-small", "text-embedding-3-large"}
+
+RETRIEVE_BATCH_SIZE = 1000
+
+VECTOR_STORE_QDRANT = "qdrant"
+VECTOR_STORE_LOCAL = "local"
+LOCAL_STORE_INITIAL_CAPACITY = 1024
+LOCAL_STORE_IVF_ITERATIONS = 10
+LOCAL_STORE_IVF_TRAIN_SAMPLE = 65536
+
+ARCHIVE_STORAGE_AZURE = "azure"
+ARCHIVE_STORAGE_LOCAL = "local"
+ARCHIVE_STORAGE_NONE = "none"
+
+QUERY_VECTOR_CACHE_AGE = 60 * 60 * 24  # 1 day
+EMBEDDING_LATENCY_WINDOW = 200
+EMBEDDING_HEDGE_MIN_SAMPLES = 20
+
+TEXT_MIME_TYPE = "text/plain"
+DEFAULT_MIME_TYPE = "application/octet-stream"
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": TEXT_MIME_TYPE,
+}
+
+PDF_EXTRACTION_PLAIN = "plain"
+PDF_EXTRACTION_LAYOUT = "layout"
+PDF_REPEATED_LINE_MIN_PAGES = 3
+PDF_REPEATED_LINE_RATIO = 0.5
+PDF_MIN_PAGE_CHARACTERS = 30
+# Share of the page height at the top and bottom searched for running headers and footers
+PDF_MARGIN_BAND_RATIO = 0.1
@@ -1,5 +1,11 @@
+import atexit
+import copy
 import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 
+import orjson
 from colorama import Fore, Style
 from decouple import config
 from pydantic_settings import BaseSettings
@@ -13,12 +19,32 @@ class ModelSettings(BaseSettings):
     AZURE_OPENAI_DEPLOYMENT_NAME: str = config("AZURE_OPENAI_DEPLOYMENT_NAME")
 
 
+class EmbeddingResilienceSettings(BaseSettings):
+    EMBEDDING_QUERY_DEADLINE: float = config("EMBEDDING_QUERY_DEADLINE", cast=float, default=2.0)
+    EMBEDDING_HEDGE_PERCENTILE: float = config("EMBEDDING_HEDGE_PERCENTILE", cast=float, default=95)
+    EMBEDDING_HEDGE_INITIAL_DELAY: float = config("EMBEDDING_HEDGE_INITIAL_DELAY", cast=float, default=0.5)
+    EMBEDDING_HEDGE_MAX_TEXTS: int = config("EMBEDDING_HEDGE_MAX_TEXTS", cast=int, default=1)
+    EMBEDDING_BREAKER_FAILURE_RATE: float = config("EMBEDDING_BREAKER_FAILURE_RATE", cast=float, default=0.5)
+    EMBEDDING_BREAKER_WINDOW: int = config("EMBEDDING_BREAKER_WINDOW", cast=int, default=50)
+    EMBEDDING_BREAKER_MIN_CALLS: int = config("EMBEDDING_BREAKER_MIN_CALLS", cast=int, default=10)
+    EMBEDDING_BREAKER_RESET_TIMEOUT: float = config("EMBEDDING_BREAKER_RESET_TIMEOUT", cast=float, default=30)
+
+
 class QdrantSettings(BaseSettings):
     QDRANT_HOST: str = config("QDRANT_HOST")
     QDRANT_HTTP_PORT: str = config("QDRANT_HTTP_PORT")
     QDRANT_GRPC_PORT: str = config("QDRANT_GRPC_PORT")
-    QDRANT_VECTOR_SIZE: str = config("QDRANT_VECTOR_SIZE")
+    QDRANT_USE_GRPC: bool = config("QDRANT_USE_GRPC", cast=bool, default=False)
+    QDRANT_GRPC_COMPRESSION: str = config("QDRANT_GRPC_COMPRESSION", default="none")
+    QDRANT_GRPC_KEEPALIVE_MS: int = config("QDRANT_GRPC_KEEPALIVE_MS", cast=int, default=30000)
+    QDRANT_TIMEOUT: int = config("QDRANT_TIMEOUT", cast=int, default=30)
+    QDRANT_MAX_CONNECTIONS: int = config("QDRANT_MAX_CONNECTIONS", cast=int, default=100)
+    QDRANT_MAX_KEEPALIVE_CONNECTIONS: int = config("QDRANT_MAX_KEEPALIVE_CONNECTIONS", cast=int, default=20)
+    QDRANT_VECTOR_SIZE: int = config("QDRANT_VECTOR_SIZE", cast=int)
     QDRANT_COLLECTION_NAME: str = config("QDRANT_COLLECTION_NAME")
+    QDRANT_USER_POINT_QUOTA: int = config("QDRANT_USER_POINT_QUOTA", cast=int, default=0)
+    QDRANT_TENANCY_MODE: str = config("QDRANT_TENANCY_MODE", default="shared")
+    QDRANT_TENANT_GROUPS: int = config("QDRANT_TENANT_GROUPS", cast=int, default=16)
 
 
 class PostgresSettings(BaseSettings):
@@ -45,13 +71,54 @@ class PostgresSettings(BaseSettings):
 class AzureStorageSettings(BaseSettings):
     AZURE_CONNECTION_STRING: str = config("AZURE_CONNECTION_STRING")
     CONTAINER_NAME: str = config("CONTAINER_NAME")
+    ARCHIVE_STORAGE_BACKEND: str = config("ARCHIVE_STORAGE_BACKEND", default="azure")
+    LOCAL_ARCHIVE_PATH: str = config("LOCAL_ARCHIVE_PATH", default="/app/archive")
+    ARCHIVE_BLOCK_SIZE: int = config("ARCHIVE_BLOCK_SIZE", cast=int, default=4 * 1024 * 1024)
+    ARCHIVE_MAX_CONCURRENCY: int = config("ARCHIVE_MAX_CONCURRENCY", cast=int, default=4)
 
 
-class AppSettings(BaseSettings):
-    PORT: int = 8000
+class ExtractionSettings(BaseSettings):
+    PDF_EXTRACTION_MODE: str = config("PDF_EXTRACTION_MODE", default="layout")
+
 
+class VectorStoreSettings(BaseSettings):
+    VECTOR_STORE_BACKEND: str = config("VECTOR_STORE_BACKEND", default="qdrant")
+    LOCAL_VECTOR_STORE_PATH: str = config("LOCAL_VECTOR_STORE_PATH", default="/app/vector_store")
+    LOCAL_VECTOR_STORE_IVF_LISTS: int = config("LOCAL_VECTOR_STORE_IVF_LISTS", cast=int, default=0)
+    LOCAL_VECTOR_STORE_IVF_PROBES: int = config("LOCAL_VECTOR_STORE_IVF_PROBES", cast=int, default=8)
+    LOCAL_VECTOR_STORE_IVF_MIN_POINTS: int = config("LOCAL_VECTOR_STORE_IVF_MIN_POINTS", cast=int, default=50000)
 
-class Settings(AppSettings, AzureStorageSettings, ModelSettings, PostgresSettings, QdrantSettings):
+
+class RateLimitSettings(BaseSettings):
+    RATE_LIMIT_SEARCH_PER_SECOND: float = config("RATE_LIMIT_SEARCH_PER_SECOND", cast=float, default=5)
+    RATE_LIMIT_SEARCH_BURST: int = config("RATE_LIMIT_SEARCH_BURST", cast=int, default=20)
+    RATE_LIMIT_INGEST_CONCURRENCY: int = config("RATE_LIMIT_INGEST_CONCURRENCY", cast=int, default=2)
+    RATE_LIMIT_INGEST_CHUNKS_PER_MINUTE: int = config("RATE_LIMIT_INGEST_CHUNKS_PER_MINUTE", cast=int, default=2000)
+    RATE_LIMIT_INGEST_TOKENS_PER_MINUTE: int = config("RATE_LIMIT_INGEST_TOKENS_PER_MINUTE", cast=int, default=200000)
+
+
+class AppSettings(BaseSettings):
+    PORT: int = 8000
+    LOG_LEVEL: str = config("LOG_LEVEL", default="INFO")
+    LOG_FORMAT: str = config("LOG_FORMAT", default="json")
+    SERVER_WORKERS: int = config("SERVER_WORKERS", cast=int, default=0)
+    SERVER_TIMEOUT: int = config("SERVER_TIMEOUT", cast=int, default=120)
+    SERVER_GRACEFUL_TIMEOUT: int = config("SERVER_GRACEFUL_TIMEOUT", cast=int, default=30)
+    SERVER_KEEPALIVE: int = config("SERVER_KEEPALIVE", cast=int, default=5)
+    HEALTH_CHECK_TIMEOUT: float = config("HEALTH_CHECK_TIMEOUT", cast=float, default=2.0)
+
+
+class Settings(
+    AppSettings,
+    AzureStorageSettings,
+    RateLimitSettings,
+    ModelSettings,
+    EmbeddingResilienceSettings,
+    ExtractionSettings,
+    PostgresSettings,
+    QdrantSettings,
+    VectorStoreSettings,
+):
     DEBUG: bool = False
     SECRET_KEY: str = config("SECRET_KEY")
     NLTK_DATA_DIR: str = "/app/nltk_data"
@@ -73,19 +140,106 @@ class ColorLogFormatter(logging.Formatter):
         return f"{color}{message}{Style.RESET_ALL}"
 
 
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(ColorLogFormatter("%(levelname)s: %(message)s"))
-logging.basicConfig(level=logging.DEBUG, handlers=[console_handler])
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line, for log collectors."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return orjson.dumps(entry).decode()
+
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Queue records with their exception and stack info for the console formatter.
+
+    `QueueHandler.prepare` formats the record and drops `exc_info`, so queued errors lost their traceback. The
+    queue stays in process, so the record only needs its arguments merged into the message.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 
 settings = Settings()
+
+console_handler = logging.StreamHandler()
+if settings.LOG_FORMAT == "json":
+    console_handler.setFormatter(JsonLogFormatter())
+else:
+    console_handler.setFormatter(ColorLogFormatter("%(levelname)s: %(message)s"))
+
+# Request handlers only enqueue records, a background thread formats and writes them
+queue_handler = RecordQueueHandler(queue.SimpleQueue())
+logging.basicConfig(level=settings.LOG_LEVEL.upper(), handlers=[queue_handler])
+log_listener = None
+
 logger = logging.getLogger(__name__)
 
 
-def get_redis():
-    """Create a Redis connection."""
-    if settings.DCOCKER_ENV == "true":
-        redis_url = "redis://redis:6379/1"
-    else:
-        redis_url = "redis://localhost:6379/1"
+def start_log_listener() -> None:
+    """
+    Start the thread writing the queued log records.
+
+    Threads do not survive a fork, so a forked worker calls this again to get a fresh queue and thread.
+    """
+    global log_listener
+
+    queue_handler.queue = queue.SimpleQueue()
+    log_listener = QueueListener(queue_handler.queue, console_handler)
+    log_listener.start()
+
+
+def stop_log_listener() -> None:
+    """Write the records still queued and stop the thread."""
+    global log_listener
+
+    if log_listener:
+        log_listener.stop()
+        log_listener = None
+
+
+start_log_listener()
+atexit.register(stop_log_listener)
+
+
+redis_client = None
+
+
+def get_redis() -> Redis:
+    """
+    Return the Redis client of the process, whose connection pool is shared by every request.
+
+    It is created on first use, so a preloading server creates it in every forked worker, not in the master.
+    """
+    global redis_client
+
+    if redis_client is None:
+        if settings.DCOCKER_ENV == "true":
+            redis_url = "redis://redis:6379/1"
+        else:
+            redis_url = "redis://localhost:6379/1"
+
+        redis_client = Redis.from_url(redis_url, decode_responses=True)
+
+    return redis_client
+
+
+async def close_redis() -> None:
+    """Close the connections of the Redis client of the process."""
+    global redis_client
 
-    return Redis.from_url(redis_url, decode_responses=True)
+    if redis_client is not None:
+        await redis_client.aclose()
+        redis_client = None
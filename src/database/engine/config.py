@@ -5,7 +5,7 @@ from src.core.settings import settings
 
 # Database settings
 Base = declarative_base()
-engine = create_async_engine(settings.DATABASE_URL, echo=True)
+engine = create_async_engine(settings.DATABASE_URL, echo=settings.DEBUG)
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
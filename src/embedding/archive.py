@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import os
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator
+
+from azure.storage.blob import BlobBlock
+from azure.storage.blob.aio import BlobServiceClient
+
+from src.clients.azure_openai import blob_service_client
+from src.core.constants import ARCHIVE_STORAGE_AZURE, ARCHIVE_STORAGE_LOCAL, ARCHIVE_STORAGE_NONE
+from src.core.settings import settings
+
+
+def get_archive_name(user_id: str, document_id: str, filename: str) -> str:
+    """Name of the archived original, grouped by user and document so a document can be found by prefix."""
+
+    return f"{get_archive_prefix(user_id, document_id)}{os.path.basename(filename)}"
+
+
+def get_archive_prefix(user_id: str, document_id: str = None) -> str:
+    """Prefix of the archived originals of a document, or of every document of the user."""
+
+    return f"{user_id}/{document_id}/" if document_id else f"{user_id}/"
+
+
+def iter_blocks(content: bytes, block_size: int) -> Iterator[memoryview]:
+    """Slice the content into upload blocks without copying it."""
+
+    view = memoryview(content)
+    for start in range(0, len(view), block_size):
+        yield view[start : start + block_size]
+
+
+class ArchiveStorage(ABC):
+    """Storage of the original files uploaded for ingest, so documents can be re-indexed without a new upload."""
+
+    @abstractmethod
+    async def upload(self, name: str, content: bytes) -> str:
+        """Store the content under `name`, replacing an existing file, and return its URI."""
+
+    @abstractmethod
+    async def download(self, name: str) -> bytes:
+        """Return the content stored under `name`."""
+
+    @abstractmethod
+    async def find(self, prefix: str) -> str | None:
+        """Return the name of the first stored file starting with `prefix`, if any."""
+
+    @abstractmethod
+    async def find_all(self, prefix: str) -> list[str]:
+        """Return the names of every stored file starting with `prefix`."""
+
+    @abstractmethod
+    async def delete_prefix(self, prefix: str) -> int:
+        """Delete every stored file starting with `prefix` and return how many were deleted."""
+
+    @abstractmethod
+    def get_uri(self, name: str) -> str:
+        """Return the URI of the file stored under `name`."""
+
+
+class AzureBlobArchive(ArchiveStorage):
+    """
+    Archive in an Azure Blob Storage container.
+
+    Files are uploaded as block blobs: blocks of `block_size` bytes are staged concurrently, at most
+    `max_concurrency` at a time, and committed once all of them are stored.
+    """
+
+    def __init__(self, service_client: BlobServiceClient, container_name: str, block_size: int, max_concurrency: int):
+        self.service_client = service_client
+        self.container_name = container_name
+        self.block_size = block_size
+        self.max_concurrency = max_concurrency
+
+    async def upload(self, name: str, content: bytes) -> str:
+        blob_client = self.service_client.get_blob_client(self.container_name, name)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def stage_block(block_id: str, block: memoryview) -> None:
+            async with semaphore:
+                await blob_client.stage_block(block_id, bytes(block))
+
+        block_list, uploads = [], []
+        for index, block in enumerate(iter_blocks(content, self.block_size)):
+            block_id = base64.b64encode(f"{index:08d}".encode()).decode()
+            block_list.append(BlobBlock(block_id=block_id))
+            uploads.append(stage_block(block_id, block))
+
+        await asyncio.gather(*uploads)
+        await blob_client.commit_block_list(block_list)
+
+        return blob_client.url
+
+    async def download(self, name: str) -> bytes:
+        blob_client = self.service_client.get_blob_client(self.container_name, name)
+        stream = await blob_client.download_blob(max_concurrency=self.max_concurrency)
+        return await stream.readall()
+
+    async def find(self, prefix: str) -> str | None:
+        container_client = self.service_client.get_container_client(self.container_name)
+        async for blob in container_client.list_blobs(name_starts_with=prefix):
+            return blob.name
+
+        return None
+
+    async def find_all(self, prefix: str) -> list[str]:
+        container_client = self.service_client.get_container_client(self.container_name)
+        return [blob.name async for blob in container_client.list_blobs(name_starts_with=prefix)]
+
+    async def delete_prefix(self, prefix: str) -> int:
+        container_client = self.service_client.get_container_client(self.container_name)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def delete_blob(name: str) -> None:
+            async with semaphore:
+                await container_client.delete_blob(name, delete_snapshots="include")
+
+        names = await self.find_all(prefix)
+        await asyncio.gather(*[delete_blob(name) for name in names])
+        return len(names)
+
+    def get_uri(self, name: str) -> str:
+        return self.service_client.get_blob_client(self.container_name, name).url
+
+
+class LocalFileArchive(ArchiveStorage):
+    """Archive in a directory of the local filesystem, for development and tests."""
+
+    def __init__(self, path: str, block_size: int):
+        self.path = Path(path).resolve()
+        self.block_size = block_size
+
+    async def upload(self, name: str, content: bytes) -> str:
+        return await asyncio.to_thread(self._write, self._resolve(name), content)
+
+    async def download(self, name: str) -> bytes:
+        return await asyncio.to_thread(self._resolve(name).read_bytes)
+
+    async def find(self, prefix: str) -> str | None:
+        directory = self._resolve(prefix)
+        if not directory.is_dir():
+            return None
+
+        names = sorted(entry.name for entry in directory.iterdir() if entry.is_file())
+        return f"{prefix}{names[0]}" if names else None
+
+    async def find_all(self, prefix: str) -> list[str]:
+        directory = self._resolve(prefix)
+        if not directory.is_dir():
+            return []
+
+        return sorted(
+            path.relative_to(self.path).as_posix()
+            for path in directory.rglob("*")
+            if path.is_file() and not path.name.endswith(".partial")
+        )
+
+    async def delete_prefix(self, prefix: str) -> int:
+        directory = self._resolve(prefix)
+        if directory == self.path:
+            raise ValueError("Refusing to delete the whole archive")
+
+        names = await self.find_all(prefix)
+        if directory.is_dir():
+            await asyncio.to_thread(shutil.rmtree, directory)
+
+        return len(names)
+
+    def get_uri(self, name: str) -> str:
+        return self._resolve(name).as_uri()
+
+    def _write(self, path: Path, content: bytes) -> str:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = path.with_name(f"{path.name}.partial")
+        with open(partial_path, "wb") as file:
+            for block in iter_blocks(content, self.block_size):
+                file.write(block)
+
+        os.replace(partial_path, path)
+        return path.as_uri()
+
+    def _resolve(self, name: str) -> Path:
+        path = (self.path / name).resolve()
+        if not path.is_relative_to(self.path):
+            raise ValueError(f"Archive name outside of the archive: {name}")
+
+        return path
+
+
+def get_archive_storage(backend: str) -> ArchiveStorage | None:
+    """Build the archive for the configured backend, `None` when archiving is disabled."""
+
+    if backend == ARCHIVE_STORAGE_AZURE:
+        return AzureBlobArchive(
+            blob_service_client,
+            settings.CONTAINER_NAME,
+            block_size=settings.ARCHIVE_BLOCK_SIZE,
+            max_concurrency=settings.ARCHIVE_MAX_CONCURRENCY,
+        )
+    if backend == ARCHIVE_STORAGE_LOCAL:
+        return LocalFileArchive(settings.LOCAL_ARCHIVE_PATH, block_size=settings.ARCHIVE_BLOCK_SIZE)
+    if backend == ARCHIVE_STORAGE_NONE:
+        return None
+
+    raise ValueError(f"Unknown archive storage backend: {backend}")
+
+
+archive_storage = get_archive_storage(settings.ARCHIVE_STORAGE_BACKEND)
@@ -0,0 +1,443 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any
+
+import numpy as np
+from qdrant_client.models import PointStruct, Record, ScoredPoint
+
+from src.core.constants import LOCAL_STORE_INITIAL_CAPACITY, LOCAL_STORE_IVF_ITERATIONS, LOCAL_STORE_IVF_TRAIN_SAMPLE
+from src.core.settings import logger, settings
+from src.embedding.vector_store import SearchFilter, VectorStore
+
+
+class UserPartition:
+    """
+    The points of a single user, stored in a directory of their own.
+
+    - `vectors.<generation>.f32`: memory-mapped float32 matrix, one unit-length row per point.
+    - `payloads.<generation>.log`: append-only JSON lines recording which point owns which row and its payload.
+    - `meta.json`: vector dimension and the current generation, bumped by `compact`.
+
+    Updates overwrite the row of the point in place and deletes only append a tombstone, so the log is the
+    source of truth and the in-memory view is rebuilt by replaying it. Every operation holds a file lock and
+    first replays the entries appended by other processes, which lets several workers share a partition.
+    """
+
+    def __init__(self, path: str, dimensions: int, ivf_lists: int, ivf_probes: int, ivf_min_points: int):
+        self.path = path
+        self.dimensions = dimensions
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.ivf_min_points = ivf_min_points
+        self._thread_lock = threading.Lock()
+        self._reset(generation=None)
+
+    def _reset(self, generation: int | None) -> None:
+        self.generation = generation
+        self.matrix = None
+        self.capacity = 0
+        self.rows = 0
+        self.log_offset = 0
+        self.ids = []
+        self.payloads = []
+        self.rows_by_id = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.created_at = np.zeros(0, dtype=np.float64)
+        self.document_ids = np.empty(0, dtype=object)
+        self.pages = np.zeros(0, dtype=np.float64)
+        self.centroids = None
+        self.assignments = None
+        self.ivf_trained_points = 0
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @property
+    def vectors_file(self) -> str:
+        return self._file(f"vectors.{self.generation}.f32")
+
+    @property
+    def log_file(self) -> str:
+        return self._file(f"payloads.{self.generation}.log")
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        os.makedirs(self.path, exist_ok=True)
+        with self._thread_lock, open(self._file("lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                self._refresh(create=exclusive)
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self, create: bool) -> None:
+        """Catch up with the files written by other processes since the last operation."""
+
+        meta_file = self._file("meta.json")
+        if not os.path.exists(meta_file):
+            if not create:
+                return
+            self._write_meta(generation=0)
+
+        with open(meta_file, encoding="utf-8") as f:
+            meta = json.load(f)
+
+        if meta["dimensions"] != self.dimensions:
+            raise ValueError(
+                f"Partition {self.path} stores {meta['dimensions']} dimensional vectors, "
+                f"but the store is configured for {self.dimensions}"
+            )
+
+        if meta["generation"] != self.generation:
+            self._reset(generation=meta["generation"])
+
+        if os.path.exists(self.vectors_file):
+            capacity = os.path.getsize(self.vectors_file) // (self.dimensions * 4)
+            if capacity != self.capacity:
+                self._map(capacity)
+
+        if os.path.exists(self.log_file):
+            with open(self.log_file, "rb") as f:
+                f.seek(self.log_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._apply(json.loads(line))
+                    self.log_offset += len(line)
+
+    def _write_meta(self, generation: int) -> None:
+        tmp_file = self._file("meta.json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"dimensions": self.dimensions, "generation": generation}, f)
+        os.replace(tmp_file, self._file("meta.json"))
+
+    def _map(self, capacity: int) -> None:
+        self.matrix = np.memmap(self.vectors_file, dtype=np.float32, mode="r+", shape=(capacity, self.dimensions))
+        grow_by = capacity - self.capacity
+        self.alive = np.concatenate([self.alive, np.zeros(grow_by, dtype=bool)])
+        self.created_at = np.concatenate([self.created_at, np.full(grow_by, np.nan)])
+        self.document_ids = np.concatenate([self.document_ids, np.empty(grow_by, dtype=object)])
+        self.pages = np.concatenate([self.pages, np.full(grow_by, np.nan)])
+        if self.assignments is not None:
+            self.assignments = np.concatenate([self.assignments, np.full(grow_by, -1, dtype=np.int32)])
+        self.capacity = capacity
+
+    def _grow(self, rows: int) -> None:
+        capacity = max(self.capacity, LOCAL_STORE_INITIAL_CAPACITY)
+        while capacity < rows:
+            capacity *= 2
+
+        if capacity == self.capacity:
+            return
+
+        if self.matrix is not None:
+            self.matrix.flush()
+        with open(self.vectors_file, "ab") as f:
+            f.truncate(capacity * self.dimensions * 4)
+        self._map(capacity)
+
+    def _apply(self, entry: dict[str, Any]) -> None:
+        row = entry["row"]
+        if entry["op"] == "delete":
+            self.alive[row] = False
+            self.rows_by_id.pop(self.ids[row], None)
+            self.payloads[row] = None
+            return
+
+        if row >= len(self.ids):
+            self.ids.extend([None] * (row + 1 - len(self.ids)))
+            self.payloads.extend([None] * (row + 1 - len(self.payloads)))
+
+        payload = entry["payload"]
+        self.ids[row] = entry["id"]
+        self.payloads[row] = payload
+        self.rows_by_id[entry["id"]] = row
+        self.alive[row] = True
+        self.created_at[row] = payload.get("created_at", np.nan)
+        self.document_ids[row] = payload.get("document_id")
+        self.pages[row] = payload.get("page", np.nan)
+        self.rows = max(self.rows, row + 1)
+
+        if self.centroids is not None:
+            self.assignments[row] = int(np.argmax(self.centroids @ self.matrix[row]))
+
+    def _append_log(self, entries: list[dict[str, Any]]) -> None:
+        data = b"".join(json.dumps(entry).encode("utf-8") + b"\n" for entry in entries)
+        with open(self.log_file, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        for entry in entries:
+            self._apply(entry)
+        self.log_offset += len(data)
+
+    def _mask(
+        self, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None
+    ) -> np.ndarray:
+        mask = self.alive[: self.rows].copy()
+        if document_id:
+            mask &= self.document_ids[: self.rows] == document_id
+        if created_before is not None:
+            mask &= self.created_at[: self.rows] < created_before
+        if keep_point_ids:
+            mask[[self.rows_by_id[point_id] for point_id in keep_point_ids if point_id in self.rows_by_id]] = False
+
+        return mask
+
+    def _search_mask(self, search_filter: SearchFilter = None) -> np.ndarray:
+        mask = self._mask()
+        if search_filter is None:
+            return mask
+
+        if search_filter.document_ids:
+            document_ids = set(search_filter.document_ids)
+            mask &= np.fromiter(
+                (document_id in document_ids for document_id in self.document_ids[: self.rows]), bool, self.rows
+            )
+
+        # Rows without a page or timestamp hold NaN, which fails every comparison
+        if search_filter.page_from is not None:
+            mask &= self.pages[: self.rows] >= search_filter.page_from
+        if search_filter.page_to is not None:
+            mask &= self.pages[: self.rows] <= search_filter.page_to
+        if search_filter.created_from is not None:
+            mask &= self.created_at[: self.rows] >= search_filter.created_from
+        if search_filter.created_to is not None:
+            mask &= self.created_at[: self.rows] <= search_filter.created_to
+
+        return mask
+
+    def upsert(self, points: list[PointStruct]) -> None:
+        with self._locked(exclusive=True):
+            next_row = self.rows
+            entries = []
+            rows = []
+            for point in points:
+                point_id = str(point.id)
+                row = self.rows_by_id.get(point_id)
+                if row is None:
+                    row = next_row
+                    next_row += 1
+                rows.append(row)
+                entries.append({"op": "upsert", "row": row, "id": point_id, "payload": point.payload or {}})
+
+            self._grow(next_row)
+            vectors = np.asarray([point.vector for point in points], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            self.matrix[rows] = vectors / np.where(norms == 0, 1, norms)
+            self.matrix.flush()
+
+            self._append_log(entries)
+
+    def search(
+        self, vector: list[float], limit: int, search_filter: SearchFilter = None
+    ) -> list[tuple[str, float, dict]]:
+        with self._locked(exclusive=False):
+            if not self.rows:
+                return []
+
+            query = np.asarray(vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1
+
+            mask = self._search_mask(search_filter)
+            if self.ivf_lists and int(mask.sum()) >= self.ivf_min_points:
+                mask &= self._probe(query)
+
+            candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+
+            if len(candidates) == self.rows:
+                scores = self.matrix[: self.rows] @ query
+            else:
+                scores = self.matrix[candidates] @ query
+
+            k = min(limit, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+
+            return [(self.ids[candidates[i]], float(scores[i]), self.payloads[candidates[i]]) for i in top]
+
+    def _probe(self, query: np.ndarray) -> np.ndarray:
+        """Restrict the search to the rows of the IVF lists closest to the query."""
+
+        live_points = int(self.alive[: self.rows].sum())
+        if self.centroids is None or live_points > 2 * self.ivf_trained_points:
+            self._train_ivf(live_points)
+
+        probes = np.argsort(-(self.centroids @ query))[: self.ivf_probes]
+        return np.isin(self.assignments[: self.rows], probes)
+
+    def _train_ivf(self, live_points: int) -> None:
+        """Cluster the unit vectors with spherical k-means and assign every row to its closest centroid."""
+
+        live_rows = np.flatnonzero(self.alive[: self.rows])
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(live_rows, min(len(live_rows), LOCAL_STORE_IVF_TRAIN_SAMPLE), replace=False))
+        sample = np.asarray(self.matrix[sample_rows])
+
+        lists = min(self.ivf_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), lists, replace=False)]
+        for _ in range(LOCAL_STORE_IVF_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(lists):
+                members = sample[labels == i]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[i] = centroid / (np.linalg.norm(centroid) or 1)
+
+        assignments = np.full(self.capacity, -1, dtype=np.int32)
+        for start in range(0, self.rows, LOCAL_STORE_IVF_TRAIN_SAMPLE):
+            end = min(start + LOCAL_STORE_IVF_TRAIN_SAMPLE, self.rows)
+            assignments[start:end] = np.argmax(self.matrix[start:end] @ centroids.T, axis=1)
+
+        self.centroids = centroids
+        self.assignments = assignments
+        self.ivf_trained_points = live_points
+        logger.info(f"Trained IVF index with {lists} lists on {len(sample)} of {live_points} points in {self.path}")
+
+    def retrieve(self, point_ids: list[str], with_vectors: bool) -> list[Record]:
+        with self._locked(exclusive=False):
+            records = []
+            for point_id in point_ids:
+                row = self.rows_by_id.get(str(point_id))
+                if row is None:
+                    continue
+                vector = self.matrix[row].tolist() if with_vectors else None
+                records.append(Record(id=self.ids[row], payload=self.payloads[row], vector=vector))
+
+            return records
+
+    def scroll(self, limit: int) -> tuple[list[Record], str | None]:
+        with self._locked(exclusive=False):
+            live_rows = np.flatnonzero(self._mask())
+            records = [Record(id=self.ids[row], payload=self.payloads[row]) for row in live_rows[:limit]]
+            next_offset = self.ids[live_rows[limit]] if len(live_rows) > limit else None
+
+            return records, next_offset
+
+    def count(self, document_id: str = None, created_before: float = None) -> int:
+        with self._locked(exclusive=False):
+            return int(self._mask(document_id, created_before).sum())
+
+    def delete(self, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None) -> int:
+        with self._locked(exclusive=True):
+            rows = np.flatnonzero(self._mask(document_id, created_before, keep_point_ids))
+            if len(rows):
+                self._append_log([{"op": "delete", "row": int(row)} for row in rows])
+
+            return len(rows)
+
+    def compact(self) -> None:
+        """Rewrite the partition without deleted rows into the next generation of files."""
+
+        with self._locked(exclusive=True):
+            live_rows = np.flatnonzero(self.alive[: self.rows])
+            if len(live_rows) == self.rows:
+                return
+
+            old_files = [self.vectors_file, self.log_file]
+            generation = self.generation + 1
+
+            capacity = LOCAL_STORE_INITIAL_CAPACITY
+            while capacity < len(live_rows):
+                capacity *= 2
+
+            vectors = np.memmap(
+                self._file(f"vectors.{generation}.f32"),
+                dtype=np.float32,
+                mode="w+",
+                shape=(capacity, self.dimensions),
+            )
+            vectors[: len(live_rows)] = self.matrix[live_rows]
+            vectors.flush()
+            del vectors
+
+            with open(self._file(f"payloads.{generation}.log"), "wb") as f:
+                for new_row, row in enumerate(live_rows):
+                    entry = {"op": "upsert", "row": new_row, "id": self.ids[row], "payload": self.payloads[row]}
+                    f.write(json.dumps(entry).encode("utf-8") + b"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._write_meta(generation)
+            for old_file in old_files:
+                if os.path.exists(old_file):
+                    os.remove(old_file)
+
+            self._refresh(create=True)
+            logger.info(f"Compacted {self.path} to {len(live_rows)} points")
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Embedded vector index for deployments without a Qdrant service.
+
+    Every user has a partition of memory-mapped float32 vectors searched with a vectorized cosine top-k.
+    Partitions with at least `ivf_min_points` points are searched through an IVF coarse index instead,
+    scoring only the rows of the `ivf_probes` closest of `ivf_lists` clusters.
+    """
+
+    def __init__(self, path: str, ivf_lists: int = 0, ivf_probes: int = 8, ivf_min_points: int = 50000):
+        self.path = path
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.ivf_min_points = ivf_min_points
+        self.vector_size = None
+        self._partitions = {}
+
+    async def create_collection(self, vector_size: int) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        self.vector_size = vector_size
+
+    def _partition(self, user_id: str) -> UserPartition:
+        partition = self._partitions.get(user_id)
+        if partition is None:
+            partition_name = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+            partition = UserPartition(
+                os.path.join(self.path, partition_name),
+                self.vector_size or settings.QDRANT_VECTOR_SIZE,
+                self.ivf_lists,
+                self.ivf_probes,
+                self.ivf_min_points,
+            )
+            self._partitions[user_id] = partition
+
+        return partition
+
+    async def add_embeddings(self, user_id: str, points: list[PointStruct]) -> None:
+        await asyncio.to_thread(self._partition(user_id).upsert, points)
+
+    async def search_similar(
+        self, user_id: str, vector: list[float], limit: int = 5, search_filter: SearchFilter = None
+    ) -> list[ScoredPoint]:
+        hits = await asyncio.to_thread(self._partition(user_id).search, vector, limit, search_filter)
+        return [ScoredPoint(id=point_id, version=0, score=score, payload=payload) for point_id, score, payload in hits]
+
+    async def retrieve_points(self, user_id: str, point_ids: list[str], with_vectors: bool = False) -> list[Record]:
+        return await asyncio.to_thread(self._partition(user_id).retrieve, point_ids, with_vectors)
+
+    async def get_all_user_embeddings(self, user_id: str, limit: int = 50) -> tuple[list[Record], Any]:
+        return await asyncio.to_thread(self._partition(user_id).scroll, limit)
+
+    async def count_user_embeddings(self, user_id: str, document_id: str = None, created_before: float = None) -> int:
+        return await asyncio.to_thread(self._partition(user_id).count, document_id, created_before)
+
+    async def delete_user_embeddings(
+        self, user_id: str, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None
+    ) -> int:
+        return await asyncio.to_thread(self._partition(user_id).delete, document_id, created_before, keep_point_ids)
+
+    async def optimize_collection(self, user_id: str) -> None:
+        await asyncio.to_thread(self._partition(user_id).compact)
+
+    async def ping(self) -> None:
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(f"Vector store directory does not exist: {self.path}")
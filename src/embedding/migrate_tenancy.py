@@ -0,0 +1,121 @@
+"""
+Move points between Qdrant tenancy modes in batches.
+
+Usage:
+    python -m src.embedding.migrate_tenancy --source shared --target per_tenant
+    python -m src.embedding.migrate_tenancy --source shared --target shard_key --target-collection embeddings_sharded
+"""
+
+import argparse
+import asyncio
+
+from qdrant_client import models
+from qdrant_client.models import PointStruct
+
+from src.clients.qdrant import client
+from src.core.constants import TENANCY_MIGRATION_BATCH_SIZE, TENANCY_PER_TENANT, TENANCY_SHARD_KEY, TENANCY_SHARED
+from src.core.settings import logger, settings
+from src.embedding.vector_db import get_tenancy
+
+
+async def migrate_points(
+    source_mode: str,
+    target_mode: str,
+    target_collection: str = None,
+    batch_size: int = TENANCY_MIGRATION_BATCH_SIZE,
+    delete_source: bool = False,
+) -> int:
+    """
+    Copy every point stored under one tenancy mode into the layout of another.
+
+    :param source_mode: Tenancy mode the points are currently stored with.
+    :param target_mode: Tenancy mode to move the points to.
+    :param target_collection: Base collection name of the target, defaults to `QDRANT_COLLECTION_NAME`.
+    :param batch_size: Number of points scrolled and upserted per request.
+    :param delete_source: Delete every batch from the source once it is upserted into the target.
+    :return: Number of migrated points.
+    :raises ValueError: if the target could write to a source collection.
+    """
+
+    source = get_tenancy(source_mode)
+    target = get_tenancy(target_mode, target_collection)
+    source_collections = await source.source_collections()
+
+    # Checked in every mode before anything is written, a shared target collection or a tenant collection
+    # overlapping a source would be overwritten and then deleted with --delete-source
+    overlapping = [name for name in source_collections if target.owns_collection(name)]
+    if overlapping:
+        raise ValueError(
+            f"The target collections must differ from the source ones ({', '.join(overlapping)}), "
+            "pass --target-collection"
+        )
+
+    await target.setup(settings.QDRANT_VECTOR_SIZE)
+
+    migrated = 0
+    for collection_name in source_collections:
+        offset = None
+        while True:
+            records, offset = await client.scroll(
+                collection_name=collection_name,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True,
+            )
+
+            points_by_user = {}
+            for record in records:
+                point = PointStruct(id=record.id, vector=record.vector, payload=record.payload)
+                points_by_user.setdefault(record.payload["user_id"], []).append(point)
+
+            for user_id, points in points_by_user.items():
+                location = await target.resolve(user_id)
+                await client.upsert(
+                    collection_name=location.collection_name,
+                    points=points,
+                    shard_key_selector=location.shard_key,
+                    wait=True,
+                )
+
+            if delete_source and records:
+                await client.delete(
+                    collection_name=collection_name,
+                    points_selector=models.PointIdsList(points=[record.id for record in records]),
+                    wait=True,
+                )
+
+            migrated += len(records)
+            logger.info(f"Migrated {migrated} points from {collection_name}")
+
+            if offset is None:
+                break
+
+    return migrated
+
+
+def main() -> None:
+    modes = [TENANCY_SHARED, TENANCY_SHARD_KEY, TENANCY_PER_TENANT]
+
+    parser = argparse.ArgumentParser(description="Move points between Qdrant tenancy modes.")
+    parser.add_argument("--source", choices=modes, required=True)
+    parser.add_argument("--target", choices=modes, required=True)
+    parser.add_argument("--target-collection", default=None)
+    parser.add_argument("--batch-size", type=int, default=TENANCY_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--delete-source", action="store_true")
+    args = parser.parse_args()
+
+    async def run() -> None:
+        try:
+            migrated = await migrate_points(
+                args.source, args.target, args.target_collection, args.batch_size, args.delete_source
+            )
+            logger.info(f"Migration finished, {migrated} points moved")
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
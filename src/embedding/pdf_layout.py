@@ -0,0 +1,159 @@
+import math
+import re
+from collections import Counter
+from typing import NamedTuple
+
+import fitz
+
+from src.core.constants import (
+    PDF_MARGIN_BAND_RATIO,
+    PDF_MIN_PAGE_CHARACTERS,
+    PDF_REPEATED_LINE_MIN_PAGES,
+    PDF_REPEATED_LINE_RATIO,
+)
+
+DIGITS_PATTERN = re.compile(r"\d+")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class ExtractionReport(NamedTuple):
+    """What layout-aware extraction removed from a document compared to its full text."""
+
+    pages: int
+    pages_dropped: int
+    lines_removed: int
+    characters_saved: int
+    tokens_saved: int | None
+
+
+class TextBlock(NamedTuple):
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    lines: list[str]
+
+
+class PageLine(NamedTuple):
+    text: str
+    in_margin: bool
+
+
+def extract_pdf_layout(content: bytes, tokenizer=None) -> tuple[dict[int, str], ExtractionReport]:
+    """
+    Extract the text of every page from its PyMuPDF blocks in reading order, without the boilerplate.
+
+    Lines in the top and bottom margins found on most pages once digits are ignored, such as running headers,
+    footers, page numbers and legal notices, are removed from every page. Lines of the page body are always
+    kept. Pages left with almost no text are dropped.
+
+    :param content: PDF file content.
+    :param tokenizer: Tokenizer used to report the tokens saved, if any.
+    :return: Text of the kept pages by page number and the report of what was removed.
+    """
+
+    with fitz.open("pdf", content) as doc:
+        page_lines = {page.number + 1: read_page_lines(page) for page in doc.pages()}
+
+    repeated_lines = find_repeated_lines(page_lines)
+
+    page_texts = {}
+    lines_removed = 0
+    for page_number, lines in page_lines.items():
+        kept_lines = [line.text for line in lines if not (line.in_margin and get_line_key(line.text) in repeated_lines)]
+        lines_removed += len(lines) - len(kept_lines)
+
+        text = "\n".join(kept_lines)
+        if sum(character.isalnum() for character in text) >= PDF_MIN_PAGE_CHARACTERS:
+            page_texts[page_number] = text
+
+    full_text = "\n".join(line.text for lines in page_lines.values() for line in lines)
+    extracted_text = "\n".join(page_texts.values())
+    tokens_saved = None
+    if tokenizer:
+        tokens_saved = len(tokenizer.encode(full_text)) - len(tokenizer.encode(extracted_text))
+
+    report = ExtractionReport(
+        pages=len(page_lines),
+        pages_dropped=len(page_lines) - len(page_texts),
+        lines_removed=lines_removed,
+        characters_saved=len(full_text) - len(extracted_text),
+        tokens_saved=tokens_saved,
+    )
+    return page_texts, report
+
+
+def read_page_lines(page: fitz.Page) -> list[PageLine]:
+    """Return the lines of a page in reading order, flagging the ones of blocks in the top or bottom margin."""
+
+    margin = page.rect.height * PDF_MARGIN_BAND_RATIO
+    top, bottom = page.rect.y0 + margin, page.rect.y1 - margin
+
+    return [
+        PageLine(line, block.y1 <= top or block.y0 >= bottom)
+        for block in read_page_blocks(page)
+        for line in block.lines
+    ]
+
+
+def read_page_blocks(page: fitz.Page) -> list[TextBlock]:
+    """Return the text blocks of a page in reading order, skipping image blocks."""
+
+    blocks = []
+    for x0, y0, x1, y1, text, _, block_type in page.get_text("blocks"):
+        if block_type != 0:
+            continue
+
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if lines:
+            blocks.append(TextBlock(x0, y0, x1, y1, lines))
+
+    return order_blocks(blocks, page.rect.width)
+
+
+def order_blocks(blocks: list[TextBlock], page_width: float) -> list[TextBlock]:
+    """
+    Order blocks for two-column pages: the left column before the right one.
+
+    Blocks crossing the middle of the page, such as titles and single-column paragraphs, split the page into
+    bands read top to bottom, so a full-width heading is read before the columns below it.
+    """
+
+    middle = page_width / 2
+    ordered_blocks = []
+    band = []
+
+    def flush_band() -> None:
+        ordered_blocks.extend(sorted([b for b in band if b.x0 < middle], key=lambda b: (b.y0, b.x0)))
+        ordered_blocks.extend(sorted([b for b in band if b.x0 >= middle], key=lambda b: (b.y0, b.x0)))
+        band.clear()
+
+    for block in sorted(blocks, key=lambda b: (b.y0, b.x0)):
+        if block.x0 < middle < block.x1:
+            flush_band()
+            ordered_blocks.append(block)
+        else:
+            band.append(block)
+
+    flush_band()
+    return ordered_blocks
+
+
+def get_line_key(line: str) -> str:
+    """Compare lines case-insensitively with every number replaced, so "Page 3 of 9" matches "Page 4 of 9"."""
+
+    return WHITESPACE_PATTERN.sub(" ", DIGITS_PATTERN.sub("#", line.lower())).strip()
+
+
+def find_repeated_lines(page_lines: dict[int, list[PageLine]]) -> set[str]:
+    """Keys of the margin lines found on at least `PDF_REPEATED_LINE_RATIO` of the pages of the document."""
+
+    if len(page_lines) < PDF_REPEATED_LINE_MIN_PAGES:
+        return set()
+
+    pages_per_line = Counter(
+        key for lines in page_lines.values() for key in {get_line_key(line.text) for line in lines if line.in_margin}
+    )
+    min_pages = max(PDF_REPEATED_LINE_MIN_PAGES, math.ceil(len(page_lines) * PDF_REPEATED_LINE_RATIO))
+
+    return {key for key, pages in pages_per_line.items() if key and pages >= min_pages}
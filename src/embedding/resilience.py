@@ -0,0 +1,256 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+import numpy as np
+from fastapi import HTTPException
+from openai import AzureOpenAI
+from openai.types import CreateEmbeddingResponse
+
+from src.clients.azure_openai import embedding_client
+from src.core.constants import EMBEDDING_HEDGE_MIN_SAMPLES, EMBEDDING_LATENCY_WINDOW
+from src.core.settings import logger, settings
+from src.embedding.services import create_text_embeddings
+from src.embedding.utils import get_cached_query_vector, store_query_vector
+
+Embedder = Callable[[list[str], int | None], Awaitable[CreateEmbeddingResponse]]
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Circuit open, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while the embedding provider is failing.
+
+    The circuit opens once at least `min_calls` of the last `window` calls are known and `failure_rate` of them
+    failed. After `reset_timeout` seconds a single trial call is let through: its success closes the circuit,
+    its failure keeps it open for another `reset_timeout`.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float,
+        window: int,
+        min_calls: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self) -> None:
+        """:raises CircuitOpenError: if the call must not reach the provider."""
+        if self._opened_at is None:
+            return
+
+        elapsed = self.clock() - self._opened_at
+        if elapsed < self.reset_timeout or self._trial_in_flight:
+            raise CircuitOpenError(max(self.reset_timeout - elapsed, 1))
+
+        self._trial_in_flight = True
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            logger.info("Embedding circuit closed")
+            self._opened_at = None
+            self._trial_in_flight = False
+            self._outcomes.clear()
+
+        self._outcomes.append(True)
+
+    def abandon_trial(self) -> None:
+        """Let the next call through as the trial when the current one ends without an outcome, e.g. cancelled."""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        if self._opened_at is not None:
+            self._opened_at = self.clock()
+            self._trial_in_flight = False
+            return
+
+        self._outcomes.append(False)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            logger.warning(f"Embedding circuit opened after {failures} failures in {len(self._outcomes)} calls")
+            self._opened_at = self.clock()
+            self._outcomes.clear()
+
+
+class LatencyTracker:
+    """Latencies of the last successful calls, used to pick the hedging delay."""
+
+    def __init__(self, window: int = EMBEDDING_LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float, default: float) -> float:
+        if len(self._samples) < EMBEDDING_HEDGE_MIN_SAMPLES:
+            return default
+
+        return float(np.percentile(self._samples, percentile))
+
+
+class ResilientEmbeddingClient:
+    """
+    Embedding calls bounded by a deadline, hedged when small and guarded by a circuit breaker.
+
+    Requests of at most `hedge_max_texts` texts still running after the `hedge_percentile` latency of recent
+    calls get a duplicate request, and the first successful response wins. Failures, including missed
+    deadlines, are counted by the circuit breaker. While the call fails or the circuit is open, `fallback`
+    answers if given, otherwise the error is raised.
+
+    `embed` is any coroutine function taking the texts and the output dimension, so the provider can be
+    replaced by a fake slow or failing one.
+    """
+
+    def __init__(
+        self,
+        embed: Embedder,
+        deadline: float,
+        breaker: CircuitBreaker,
+        hedge_percentile: float = 0,
+        hedge_initial_delay: float = 0.5,
+        hedge_max_texts: int = 1,
+        latencies: LatencyTracker = None,
+        fallback: Embedder = None,
+    ):
+        self.embed = embed
+        self.deadline = deadline
+        self.breaker = breaker
+        self.hedge_percentile = hedge_percentile
+        self.hedge_initial_delay = hedge_initial_delay
+        self.hedge_max_texts = hedge_max_texts
+        self.latencies = latencies or LatencyTracker()
+        self.fallback = fallback
+
+    async def create(self, texts: list[str], dimensions: int = None) -> CreateEmbeddingResponse:
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            if self.fallback:
+                return await self.fallback(texts, dimensions)
+            raise
+
+        try:
+            response = await asyncio.wait_for(self._call(texts, dimensions), timeout=self.deadline)
+        except Exception as e:
+            self.breaker.record_failure()
+            logger.warning(f"Embedding request failed: {str(e) or type(e).__name__}")
+            if self.fallback:
+                return await self.fallback(texts, dimensions)
+            raise
+        except BaseException:
+            # A cancelled call, e.g. the client disconnected, says nothing about the provider
+            self.breaker.abandon_trial()
+            raise
+
+        self.breaker.record_success()
+        return response
+
+    async def _call(self, texts: list[str], dimensions: int | None) -> CreateEmbeddingResponse:
+        if not self.hedge_percentile or len(texts) > self.hedge_max_texts:
+            return await self._timed_call(texts, dimensions)
+
+        hedge_delay = self.latencies.percentile(self.hedge_percentile, self.hedge_initial_delay)
+        pending = {asyncio.create_task(self._timed_call(texts, dimensions))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if not done:
+                pending.add(asyncio.create_task(self._timed_call(texts, dimensions)))
+
+            while True:
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = attempt.exception()
+
+                if not pending:
+                    raise error
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+
+    async def _timed_call(self, texts: list[str], dimensions: int | None) -> CreateEmbeddingResponse:
+        started_at = time.perf_counter()
+        response = await self.embed(texts, dimensions)
+        self.latencies.record(time.perf_counter() - started_at)
+        return response
+
+
+def get_azure_embedder(client: AzureOpenAI, timeout: float) -> Embedder:
+    """
+    Embed with Azure OpenAI, timing out at the deadline without client retries.
+
+    The client call runs in a worker thread that cancellation cannot stop, so its own timeout is what frees the
+    thread of an abandoned hedge or a missed deadline.
+    """
+    client = client.with_options(timeout=timeout, max_retries=0)
+
+    async def embed(texts: list[str], dimensions: int = None) -> CreateEmbeddingResponse:
+        return await create_text_embeddings(client, texts, dimensions)
+
+    return embed
+
+
+query_embedding_client = ResilientEmbeddingClient(
+    get_azure_embedder(embedding_client, settings.EMBEDDING_QUERY_DEADLINE),
+    deadline=settings.EMBEDDING_QUERY_DEADLINE,
+    breaker=CircuitBreaker(
+        failure_rate=settings.EMBEDDING_BREAKER_FAILURE_RATE,
+        window=settings.EMBEDDING_BREAKER_WINDOW,
+        min_calls=settings.EMBEDDING_BREAKER_MIN_CALLS,
+        reset_timeout=settings.EMBEDDING_BREAKER_RESET_TIMEOUT,
+    ),
+    hedge_percentile=settings.EMBEDDING_HEDGE_PERCENTILE,
+    hedge_initial_delay=settings.EMBEDDING_HEDGE_INITIAL_DELAY,
+    hedge_max_texts=settings.EMBEDDING_HEDGE_MAX_TEXTS,
+)
+
+
+async def embed_search_query(
+    redis, text: str, client: ResilientEmbeddingClient = query_embedding_client
+) -> list[float]:
+    """
+    Embed a search query, answering repeated queries from the query-vector cache without calling the provider.
+
+    :raises HTTPException: 503 if the query is not cached and the embedding service failed or its circuit is open.
+    """
+
+    dimensions = settings.QDRANT_VECTOR_SIZE
+    embedding = await get_cached_query_vector(redis, text, dimensions)
+    if embedding:
+        return embedding
+
+    try:
+        response = await client.create([text], dimensions)
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Embedding service unavailable",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except Exception:
+        raise HTTPException(status_code=503, detail="Embedding service unavailable")
+
+    embedding = response.data[0].embedding
+    await store_query_vector(redis, text, dimensions, embedding)
+    return embedding
@@ -1,60 +1,199 @@
-import asyncio
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from typing import Literal, Optional
 
-import tiktoken
-from fastapi import APIRouter, Query, File, UploadFile, Form
+import numpy as np
+from fastapi import APIRouter, BackgroundTasks, Query, File, UploadFile, Form, Header, Path, Response
 from fastapi.params import Depends
 from pydantic import BaseModel
 
+from src.auth.rate_limit import RateLimiter, ingest_admission, search_admission
 from src.auth.utils import get_current_user
 from src.clients.azure_openai import embedding_client
-from src.core.settings import settings
-from src.embedding.services import get_text_extractor_service, get_embedding_service
-from src.embedding.vector_db import search_similar, get_all_user_embeddings
+from src.core.constants import DOCUMENT_ID_PATTERN, MAX_CONTEXT_WINDOW
+from src.core.settings import get_redis
+from src.embedding.archive import archive_storage, get_archive_prefix
+from src.embedding.resilience import embed_search_query
+from src.embedding.services import (
+    get_embedding_service,
+    get_text_extractor_service,
+    get_tokenizer,
+)
+from src.embedding.utils import (
+    begin_idempotent_request,
+    clear_ingest_checkpoints,
+    complete_idempotent_request,
+    invalidate_user_point_count,
+    release_idempotent_request,
+)
+from src.embedding.vector_db import (
+    count_user_embeddings,
+    delete_user_embeddings,
+    get_all_user_embeddings,
+    get_chunk_context,
+    get_point_vectors,
+    optimize_collection,
+    search_similar,
+)
+from src.embedding.vector_store import SearchFilter
 
 router = APIRouter()
 
+# Qdrant vacuums deleted points on its own with the thresholds set on the collection
+OPTIMIZE_DESCRIPTION = "Compact the user's partition after the delete, only used by the local vector store."
+
 
 class SearchEmbeddingRequest(BaseModel):
     text: str
     limit: int = Form(default=5)
     score: float = Form(None)
+    context_window: int = Form(default=0, ge=0, le=MAX_CONTEXT_WINDOW)
+    document_ids: Optional[list[str]] = Form(None)
+    page_from: Optional[int] = Form(None, ge=1)
+    page_to: Optional[int] = Form(None, ge=1)
+    created_from: Optional[datetime] = Form(None)
+    created_to: Optional[datetime] = Form(None)
+
+    def get_search_filter(self) -> SearchFilter | None:
+        """Build the server-side search filter, timestamps without a timezone are read as UTC."""
+        search_filter = SearchFilter(
+            document_ids=tuple(self.document_ids or ()),
+            page_from=self.page_from,
+            page_to=self.page_to,
+            created_from=_to_timestamp(self.created_from),
+            created_to=_to_timestamp(self.created_to),
+        )
+        return search_filter if search_filter != SearchFilter() else None
+
+
+def _to_timestamp(value: datetime | None) -> float | None:
+    if value is None:
+        return None
+
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
 
 
 @router.post("/add-embedding")
 async def add_embedding_router(
     text: Optional[str] = Form(None),
     file: Optional[UploadFile] = File(None),
+    vectors_format: Optional[Literal["float32", "npy"]] = Form(None),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
     auth_payload: dict = Depends(get_current_user),
+    redis=Depends(get_redis),
+    rate_limiter: RateLimiter = Depends(ingest_admission),
 ):
-    """Add an embedding for the provided text input."""
+    """
+    Add an embedding for the provided text input.
+
+    Returns a summary of the stored chunks. With `vectors_format` the stored vectors are returned instead,
+    as a row-major float32 matrix (`float32`) or a NumPy file (`npy`), with rows in `point_ids` order.
+    """
+
+    tokenizer = get_tokenizer()
+    text_extractor = await get_text_extractor_service()
+    embedding_service = await get_embedding_service(
+        embedding_client=embedding_client,
+        text_extractor=text_extractor,
+        tokenizer=tokenizer,
+        max_tokens=50,
+        redis=redis,
+        rate_limiter=rate_limiter,
+        archive=archive_storage,
+    )
 
-    tokenizer = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    user_id = auth_payload.get("user").get("sub")
+    if not idempotency_key:
+        response = await embedding_service.create_embeddings(user_id, text, file)
+    else:
+        response = await begin_idempotent_request(redis, user_id, idempotency_key)
+        if response is None:
+            try:
+                response = await embedding_service.create_embeddings(user_id, text, file)
+            except Exception:
+                await release_idempotent_request(redis, user_id, idempotency_key)
+                raise
+
+            if response.get("status") == "success":
+                await complete_idempotent_request(redis, user_id, idempotency_key, response)
+            else:
+                await release_idempotent_request(redis, user_id, idempotency_key)
+
+    if vectors_format and response.get("status") == "success":
+        return await _vectors_response(user_id, response, vectors_format)
+
+    return response
+
+
+@router.post("/reindex-document/{document_id}")
+async def reindex_document_router(
+    document_id: str = Path(pattern=DOCUMENT_ID_PATTERN),
+    auth_payload: dict = Depends(get_current_user),
+    redis=Depends(get_redis),
+    rate_limiter: RateLimiter = Depends(ingest_admission),
+) -> dict:
+    """Re-extract, re-chunk and re-embed a document of the authenticated user from its archived original."""
+
+    tokenizer = get_tokenizer()
     text_extractor = await get_text_extractor_service()
     embedding_service = await get_embedding_service(
         embedding_client=embedding_client,
         text_extractor=text_extractor,
         tokenizer=tokenizer,
         max_tokens=50,
+        redis=redis,
+        rate_limiter=rate_limiter,
+        archive=archive_storage,
     )
 
     user_id = auth_payload.get("user").get("sub")
-    return await embedding_service.create_embeddings(user_id, text, file)
+    return await embedding_service.reindex_document(user_id, document_id)
+
+
+async def _vectors_response(user_id: str, ingest_summary: dict, vectors_format: str) -> Response:
+    vectors = np.asarray(await get_point_vectors(user_id, ingest_summary["point_ids"]), dtype=np.float32)
+    headers = {
+        "X-Vector-Count": str(vectors.shape[0]),
+        "X-Vector-Dimensions": str(vectors.shape[1] if vectors.ndim == 2 else 0),
+        "X-Document-Ids": ",".join(ingest_summary["document_ids"]),
+    }
 
+    if vectors_format == "npy":
+        buffer = BytesIO()
+        np.save(buffer, vectors, allow_pickle=False)
+        headers["Content-Disposition"] = 'attachment; filename="embeddings.npy"'
+        return Response(content=buffer.getvalue(), media_type="application/octet-stream", headers=headers)
 
-@router.post("/search-embedding", dependencies=[Depends(get_current_user)])
-async def search_text_embedding_router(request_data: SearchEmbeddingRequest) -> dict:
+    return Response(content=vectors.tobytes(), media_type="application/octet-stream", headers=headers)
+
+
+@router.post("/search-embedding", dependencies=[Depends(search_admission)])
+async def search_text_embedding_router(
+    request_data: SearchEmbeddingRequest, auth_payload: dict = Depends(get_current_user), redis=Depends(get_redis)
+) -> dict:
     """Search for similar embeddings based on the provided text input."""
 
-    response = await asyncio.to_thread(
-        embedding_client.embeddings.create,
-        input=[request_data.text],
-        model=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
+    user_id = auth_payload.get("user").get("sub")
+
+    embedding = await embed_search_query(redis, request_data.text)
+    search_result = await search_similar(
+        user_id, vector=embedding, limit=request_data.limit, search_filter=request_data.get_search_filter()
     )
+    context = await get_chunk_context(user_id, search_result, window=request_data.context_window)
 
-    embedding = response.data[0].embedding
-    search_result = await search_similar(vector=embedding, limit=request_data.limit)
-    response = [{"id": r.id, "score": r.score, "text": r.payload.get("text")} for r in search_result]
+    response = []
+    for r in search_result:
+        result = {
+            "id": r.id,
+            "score": r.score,
+            "text": r.payload.get("text"),
+            "document_id": r.payload.get("document_id"),
+            "filename": r.payload.get("filename"),
+            "page": r.payload.get("page"),
+        }
+        if request_data.context_window:
+            result["context"] = context.get(str(r.id), [])
+        response.append(result)
 
     return {"status": "success", "results": response}
 
@@ -71,3 +210,79 @@ async def get_all_embeddings_router(
     response = [r for r in embeddings[0]]
 
     return {"status": "success", "embeddings": response}
+
+
+@router.delete("/delete-embeddings/", status_code=200)
+async def delete_embeddings_router(
+    background_tasks: BackgroundTasks,
+    older_than_days: Optional[int] = Query(default=None, ge=0),
+    optimize: bool = Query(default=False, description=OPTIMIZE_DESCRIPTION),
+    auth_payload: dict = Depends(get_current_user),
+    redis=Depends(get_redis),
+) -> dict:
+    """
+    Delete all embeddings of the authenticated user, or only the ones older than the given number of days.
+
+    The archived originals of the documents left without embeddings are deleted too.
+    """
+
+    user_id = auth_payload.get("user").get("sub")
+    created_before = None
+    if older_than_days is not None:
+        created_before = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).timestamp()
+
+    deleted = await delete_user_embeddings(user_id, created_before=created_before)
+    archives_deleted = await _delete_archives(user_id, only_without_points=created_before is not None)
+    await _after_delete(background_tasks, redis, user_id, optimize)
+
+    return {"status": "success", "deleted": deleted, "archives_deleted": archives_deleted}
+
+
+@router.delete("/delete-document/{document_id}", status_code=200)
+async def delete_document_router(
+    background_tasks: BackgroundTasks,
+    document_id: str = Path(pattern=DOCUMENT_ID_PATTERN),
+    optimize: bool = Query(default=False, description=OPTIMIZE_DESCRIPTION),
+    auth_payload: dict = Depends(get_current_user),
+    redis=Depends(get_redis),
+) -> dict:
+    """Delete all embeddings and the archived original of a document owned by the authenticated user."""
+
+    user_id = auth_payload.get("user").get("sub")
+
+    deleted = await delete_user_embeddings(user_id, document_id=document_id)
+    archives_deleted = await _delete_archives(user_id, document_id)
+    await _after_delete(background_tasks, redis, user_id, optimize)
+
+    return {"status": "success", "deleted": deleted, "archives_deleted": archives_deleted}
+
+
+async def _delete_archives(user_id: str, document_id: str = None, only_without_points: bool = False) -> int:
+    """
+    Delete the archived originals of deleted documents, so a re-index cannot bring them back.
+
+    :param document_id: Document to delete the original of, every document of the user by default.
+    :param only_without_points: Keep the originals of the documents that still have stored points.
+    :return: Number of deleted files.
+    """
+    if not archive_storage:
+        return 0
+
+    if not only_without_points:
+        return await archive_storage.delete_prefix(get_archive_prefix(user_id, document_id))
+
+    names = await archive_storage.find_all(get_archive_prefix(user_id, document_id))
+    archives_deleted = 0
+    for archived_document_id in dict.fromkeys(name.split("/")[1] for name in names):
+        if not await count_user_embeddings(user_id, document_id=archived_document_id):
+            archives_deleted += await archive_storage.delete_prefix(get_archive_prefix(user_id, archived_document_id))
+
+    return archives_deleted
+
+
+async def _after_delete(background_tasks: BackgroundTasks, redis, user_id: str, optimize: bool) -> None:
+    await invalidate_user_point_count(redis, user_id)
+    await clear_ingest_checkpoints(redis, user_id)
+
+    if optimize:
+        background_tasks.add_task(optimize_collection, user_id)
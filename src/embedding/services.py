@@ -1,21 +1,66 @@
 import asyncio
+import hashlib
+import os
 import re
-import uuid
+from datetime import datetime, timezone
+from functools import lru_cache
 from io import BytesIO
 from typing import Any
 
 import fitz
+import nltk
+import tiktoken
 from docx import Document
-from fastapi import UploadFile
+from fastapi import HTTPException, UploadFile
 from nltk import sent_tokenize
 from openai import AzureOpenAI
 from openai.types import CreateEmbeddingResponse
-
+from qdrant_client.models import PointStruct
+
+from src.core.constants import (
+    DEFAULT_MIME_TYPE,
+    INGEST_BATCH_SIZE,
+    MATRYOSHKA_EMBEDDING_MODELS,
+    MIME_TYPES,
+    PDF_EXTRACTION_LAYOUT,
+    TEXT_MIME_TYPE,
+)
 from src.core.settings import logger, settings
-from src.embedding.vector_db import add_embedding
+from src.embedding.archive import ArchiveStorage, get_archive_name, get_archive_prefix
+from src.embedding.pdf_layout import extract_pdf_layout
+from src.embedding.utils import (
+    clear_ingest_checkpoint,
+    get_document_id,
+    get_ingest_checkpoint,
+    get_user_point_count,
+    invalidate_user_point_count,
+    store_ingest_checkpoint,
+    truncate_embeddings,
+)
+from src.embedding.vector_db import add_embeddings, count_user_embeddings, delete_user_embeddings, get_point_id
+
+# Whitespace runs, including backspace characters left by some PDF producers
+WHITESPACE_PATTERN = re.compile(r"[\s\x08]+")
+
+
+# Chunk metadata copied to the point payload when the source provides it
+OPTIONAL_PAYLOAD_FIELDS = ("part", "page", "filename", "mime_type", "source_uri")
+
+
+def get_mime_type(filename: str) -> str:
+    return MIME_TYPES.get(os.path.splitext(filename)[1].lower(), DEFAULT_MIME_TYPE)
+
+
+def normalize_whitespace(text: str) -> str:
+    """Collapse every whitespace run into a single space in one pass and strip the ends."""
+    return WHITESPACE_PATTERN.sub(" ", text).strip()
 
 
 class TextExtractorService:
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+        self.report = None
+
     async def extract_text(self, filename: str, file_bytes: BytesIO) -> tuple[str, bool] | tuple[None, bool]:
         """
         Extracts text from a file bytes steam based on the file extension.
@@ -27,6 +72,7 @@ class TextExtractorService:
             - Tuple (`None`, `False`) if an error occurs or unsupported file type.
         """
 
+        self.report = None
         try:
             # if filename.endswith(".txt"):
             #     return await self._extract_text_from_txt(file_bytes)
@@ -73,7 +119,7 @@ class TextExtractorService:
 
         try:
             logger.info(f"Starting text extraction from DOCX file")
-            doc = Document(file_bytes)
+            doc = await asyncio.to_thread(Document, file_bytes)
             result = " ".join([para.text for para in doc.paragraphs if para.text.strip()])
             logger.info(f"Text extracted successfully")
 
@@ -95,14 +141,19 @@ class TextExtractorService:
 
         try:
             logger.info(f"Starting text extraction from PDF file")
-            doc = fitz.open("pdf", file_bytes.read())
+            if settings.PDF_EXTRACTION_MODE == PDF_EXTRACTION_LAYOUT:
+                raw_page_texts, self.report = await asyncio.to_thread(
+                    extract_pdf_layout, file_bytes.read(), self.tokenizer
+                )
+                logger.info(f"Layout extraction removed {self.report.lines_removed} lines")
+            else:
+                raw_page_texts = await asyncio.to_thread(self._read_pdf_pages, file_bytes.read())
 
             page_texts = {}
-            for page in doc.pages():
-                text = page.get_text()
+            for page_number, text in raw_page_texts.items():
                 cleaned_text = await self.clean_text(text)
                 if cleaned_text.strip():
-                    page_texts[page.number + 1] = cleaned_text
+                    page_texts[page_number] = cleaned_text
 
             logger.info(f"Text extracted successfully")
             # cleaned_text = await self.clean_text(result)
@@ -111,13 +162,17 @@ class TextExtractorService:
             logger.error(f"TextExtractorService {str(e)}")
             return None, False
 
+    @staticmethod
+    def _read_pdf_pages(content: bytes) -> dict[int, str]:
+        """Parse the PDF and return the raw text of every page, run in a worker thread to keep the loop free."""
+        with fitz.open("pdf", content) as doc:
+            return {page.number + 1: page.get_text() for page in doc.pages()}
+
     @staticmethod
     async def clean_text(text) -> str:
-        cleaned = re.sub(r"[\n\r\t\b]", " ", text)
-        cleaned = re.sub(r"\s+", " ", cleaned)
-        cleaned = cleaned.strip()
+        cleaned = normalize_whitespace(text)
 
-        logger.info(f"Cleaning text from {len(cleaned)} characters")
+        logger.debug(f"Cleaning text from {len(cleaned)} characters")
         return cleaned
 
 
@@ -164,7 +219,14 @@ class SentenceAwareChunker:
 
 class CreateEmbeddingService(SentenceAwareChunker):
     def __init__(
-        self, embedding_client: AzureOpenAI, text_extractor: TextExtractorService, tokenizer, max_tokens: int = 500
+        self,
+        embedding_client: AzureOpenAI,
+        text_extractor: TextExtractorService,
+        tokenizer,
+        max_tokens: int = 500,
+        redis=None,
+        rate_limiter=None,
+        archive: ArchiveStorage = None,
     ):
         super().__init__(tokenizer, max_tokens)
 
@@ -172,18 +234,27 @@ class CreateEmbeddingService(SentenceAwareChunker):
         self.text_extractor = text_extractor
         self.tokenizer = tokenizer
         self.max_tokens = max_tokens
+        self.redis = redis
+        self.rate_limiter = rate_limiter
+        self.archive = archive
+        self.extraction_reports = {}
 
     async def create_embeddings(self, user_id: str, text: str = None, file: UploadFile = None) -> dict[str, Any]:
         text_chunks = []
 
         if text:
-            chunks = await self.chunk_text(text)
-            text_chunks.extend([{"text": c} for c in chunks])
+            document_id = get_document_id(text.encode("utf-8"))
+            chunks = await self.chunk_text(await self.text_extractor.clean_text(text))
+            text_chunks.extend(
+                [
+                    {"text": c, "document_id": document_id, "chunk_index": i, "mime_type": TEXT_MIME_TYPE}
+                    for i, c in enumerate(chunks)
+                ]
+            )
 
         if file:
             file_bytes = await file.read()
-            file_stream = BytesIO(file_bytes)
-            file_chunks, is_extracted = await self._extract_text_as_chunks(file.filename, file_stream)
+            file_chunks, is_extracted = await self._get_file_chunks(user_id, file.filename, file_bytes)
 
             if not is_extracted:
                 logger.error(f"Failed to extract text from file: {file.filename}")
@@ -194,67 +265,311 @@ class CreateEmbeddingService(SentenceAwareChunker):
         if not text_chunks:
             return {"status": "error", "message": "No text provided."}
 
-        cleaned_chunks = await self._clean_text_chunks(text_chunks)
-        model_response = await self.send_chunks_to_embedding_service(cleaned_chunks)
-        if not model_response or not model_response.data:
-            logger.error("Failed to create embeddings.")
-            return {"status": "error", "message": "Failed to create embeddings."}
+        return await self._store_chunks(user_id, text_chunks)
 
-        await self._add_chunks_to_vector_db(text_chunks, model_response, user_id)
+    async def reindex_document(self, user_id: str, document_id: str) -> dict[str, Any]:
+        """
+        Rebuild the chunks and embeddings of a document from its archived original.
+
+        The stored points of the document are replaced, so changes to extraction or chunking apply to it
+        without the client uploading the file again. The new chunks are stored before the points missing from
+        them are deleted, so a rejected or failed re-index leaves the document searchable and its retry resumes
+        after the last stored batch.
+        """
+        if not self.archive:
+            return {"status": "error", "message": "Archive storage is disabled."}
 
-        return {"status": "success", "chunks_saved": model_response}
+        archive_name = await self.archive.find(get_archive_prefix(user_id, document_id))
+        if not archive_name:
+            return {"status": "error", "message": "Archived document not found."}
 
-    async def send_chunks_to_embedding_service(self, text_chunks: list[str]) -> CreateEmbeddingResponse | None:
-        try:
-            response = await asyncio.to_thread(
-                self.embedding_client.embeddings.create,
-                input=text_chunks,
-                model=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
+        file_bytes = await self.archive.download(archive_name)
+        filename = archive_name.rsplit("/", 1)[-1]
+        text_chunks, is_extracted = await self._extract_text_as_chunks(filename, BytesIO(file_bytes), document_id)
+
+        if not is_extracted:
+            logger.error(f"Failed to extract text from archived file: {archive_name}")
+            return {"status": "error", "message": "Failed to extract text from file."}
+
+        source_uri = self.archive.get_uri(archive_name)
+        for chunk in text_chunks:
+            chunk["source_uri"] = source_uri
+
+        job_id = self._get_reindex_job_id(text_chunks)
+        stored_points = await count_user_embeddings(user_id, document_id=document_id)
+        summary = await self._store_chunks(user_id, text_chunks, job_id, replaced_points=stored_points)
+        if summary["status"] == "success" and self.redis:
+            await clear_ingest_checkpoint(self.redis, user_id, job_id)
+
+        return summary
+
+    async def _store_chunks(
+        self, user_id: str, text_chunks: list[dict], job_id: str = None, replaced_points: int = 0
+    ) -> dict[str, Any]:
+        """
+        Embed and store the chunks in batches, resuming after the last checkpointed batch of the same ingest.
+
+        Once every batch is stored, points of the documents missing from the new chunks, such as trailing chunks
+        of an earlier extraction or chunking, are deleted.
+
+        :param job_id: Checkpoint of the ingest, derived from the documents and chunking by default.
+        :param replaced_points: Stored points the chunks replace, not counted again against the quota.
+        :raises HTTPException: 429 once the ingest budget is spent, the batches stored so far are checkpointed
+            so the retry resumes after them.
+        """
+        job_id = job_id or self._get_ingest_job_id(text_chunks)
+        batches_done = await get_ingest_checkpoint(self.redis, user_id, job_id) if self.redis else 0
+        if batches_done:
+            logger.info(f"Resuming ingest {job_id} from batch {batches_done}")
+
+        chunks_resumed = min(batches_done * INGEST_BATCH_SIZE, len(text_chunks))
+        await self._check_point_quota(user_id, len(text_chunks) - chunks_resumed - replaced_points)
+
+        created_at = datetime.now(timezone.utc).timestamp()
+        responses = []
+        for batch_number, start in enumerate(range(0, len(text_chunks), INGEST_BATCH_SIZE)):
+            if batch_number < batches_done:
+                continue
+
+            batch = text_chunks[start : start + INGEST_BATCH_SIZE]
+            if self.rate_limiter:
+                tokens = sum([await self.count_tokens(chunk["text"]) for chunk in batch])
+                await self.rate_limiter.consume_ingest(user_id, len(batch), tokens)
+
+            model_response = await self.send_chunks_to_embedding_service([chunk["text"] for chunk in batch])
+            if not model_response or not model_response.data:
+                logger.error("Failed to create embeddings.")
+                return {"status": "error", "message": "Failed to create embeddings."}
+
+            await self._add_chunks_to_vector_db(batch, model_response, user_id, created_at)
+            responses.append(model_response)
+
+            if self.redis:
+                await store_ingest_checkpoint(self.redis, user_id, job_id, batch_number + 1)
+                await invalidate_user_point_count(self.redis, user_id)
+
+        summary = self._summarize_ingest(user_id, text_chunks, responses, chunks_resumed)
+        summary["stale_points_deleted"] = 0
+        for document_id in summary["document_ids"]:
+            summary["stale_points_deleted"] += await delete_user_embeddings(
+                user_id, document_id=document_id, keep_point_ids=summary["point_ids"]
             )
+        if self.redis and summary["stale_points_deleted"]:
+            await invalidate_user_point_count(self.redis, user_id)
+
+        if self.extraction_reports:
+            summary["extraction"] = self.extraction_reports
+
+        return summary
 
-            return response
+    async def send_chunks_to_embedding_service(
+        self, text_chunks: list[str], dimensions: int = None
+    ) -> CreateEmbeddingResponse | None:
+        try:
+            return await create_text_embeddings(self.embedding_client, text_chunks, dimensions)
         except Exception as e:
             logger.error(f"Error sending chunks to embedding service: {str(e)}")
             return None
 
-    async def _extract_text_as_chunks(self, filename: str, file_stream: BytesIO) -> tuple[list[dict] | None, bool]:
+    async def _get_file_chunks(self, user_id: str, filename: str, file_bytes: bytes) -> tuple[list[dict] | None, bool]:
+        """Extract and chunk an uploaded file while its original is archived, linking the chunks to the archive."""
+        document_id = get_document_id(file_bytes)
+        archive_task = None
+        if self.archive:
+            archive_name = get_archive_name(user_id, document_id, filename)
+            archive_task = asyncio.create_task(self.archive.upload(archive_name, file_bytes))
+
+        text_chunks, is_extracted = await self._extract_text_as_chunks(filename, BytesIO(file_bytes), document_id)
+        if archive_task is None:
+            return text_chunks, is_extracted
+
+        if not is_extracted:
+            archive_task.cancel()
+            return text_chunks, is_extracted
+
+        try:
+            source_uri = await archive_task
+        except Exception as e:
+            logger.error(f"Failed to archive file {filename}: {str(e)}")
+            return text_chunks, is_extracted
+
+        for chunk in text_chunks:
+            chunk["source_uri"] = source_uri
+
+        return text_chunks, is_extracted
+
+    async def _extract_text_as_chunks(
+        self, filename: str, file_stream: BytesIO, document_id: str
+    ) -> tuple[list[dict] | None, bool]:
         extracted_parts, is_extracted = await self.text_extractor.extract_text(filename, file_stream)
         if not is_extracted:
             logger.error(f"Failed to extract text from file: {filename}")
             return None, False
 
+        if self.text_extractor.report:
+            self.extraction_reports[document_id] = self.text_extractor.report._asdict()
+
+        # PDF text is split by page, a DOCX is a single part
+        if isinstance(extracted_parts, str):
+            extracted_parts = {None: extracted_parts}
+
+        file_metadata = {"filename": os.path.basename(filename), "mime_type": get_mime_type(filename)}
         text_chunks = []
         for part_number, part_text in extracted_parts.items():
             chunks = await self.chunk_text(part_text)
-            for chunk in chunks:
-                text_chunks.append({"text": chunk, "part": part_number})
+            for chunk_index, chunk in enumerate(chunks):
+                chunk_data = {"text": chunk, "document_id": document_id, "chunk_index": chunk_index, **file_metadata}
+                if part_number is not None:
+                    chunk_data["part"] = part_number
+                    chunk_data["page"] = part_number
+
+                text_chunks.append(chunk_data)
 
         return text_chunks, True
 
-    async def _add_chunks_to_vector_db(self, text_chunks: list[dict], model_response, user_id: str) -> None:
+    async def _add_chunks_to_vector_db(
+        self, text_chunks: list[dict], model_response, user_id: str, created_at: float
+    ) -> None:
+        points = []
         for chunk_data, embedding_data in zip(text_chunks, model_response.data):
-            embedding = embedding_data.embedding
-            point_id = str(uuid.uuid4())
-
-            payload = {"id": point_id, "user_id": user_id, "text": chunk_data["text"]}
+            point_id = get_point_id(
+                user_id, chunk_data["document_id"], chunk_data.get("part"), chunk_data["chunk_index"]
+            )
 
-            if "part" in chunk_data:
-                payload["part"] = chunk_data["part"]
+            payload = {
+                "id": point_id,
+                "user_id": user_id,
+                "text": chunk_data["text"],
+                "document_id": chunk_data["document_id"],
+                "chunk_index": chunk_data["chunk_index"],
+                "created_at": created_at,
+            }
+
+            for field_name in OPTIONAL_PAYLOAD_FIELDS:
+                if field_name in chunk_data:
+                    payload[field_name] = chunk_data[field_name]
+
+            points.append(PointStruct(id=point_id, vector=embedding_data.embedding, payload=payload))
+
+        await add_embeddings(user_id, points)
+
+    async def _check_point_quota(self, user_id: str, new_points: int) -> None:
+        """Reject the ingest before embedding if it would exceed the user's stored points quota."""
+        quota = settings.QDRANT_USER_POINT_QUOTA
+        if not quota:
+            return
+
+        if self.redis:
+            stored_points = await get_user_point_count(self.redis, user_id)
+        else:
+            stored_points = await count_user_embeddings(user_id)
+
+        if stored_points + new_points > quota:
+            raise HTTPException(
+                status_code=403,
+                detail=f"Stored embeddings quota exceeded: {stored_points} of {quota} points used",
+            )
 
-            await add_embedding(vector=embedding, payload=payload)
+    def _get_ingest_job_id(self, text_chunks: list[dict]) -> str:
+        """
+        Identify an ingest by its documents, extraction, chunking and chunks so a retry finds the same checkpoint.
 
-    async def _clean_text_chunks(self, text_chunks: list[dict]) -> list[str]:
-        cleaned_texts = []
+        A document uploaded again after extraction or chunking changed produces other chunks and is embedded again.
+        """
+        document_ids = sorted({chunk["document_id"] for chunk in text_chunks})
+        job_key = f"{':'.join(document_ids)}:{settings.PDF_EXTRACTION_MODE}:{self.max_tokens}:{INGEST_BATCH_SIZE}"
+        digest = hashlib.sha256(job_key.encode("utf-8"))
         for chunk in text_chunks:
-            cleaned_text = await self.text_extractor.clean_text(chunk["text"])
-            cleaned_texts.append(cleaned_text)
+            digest.update(chunk["text"].encode("utf-8"))
+
+        return digest.hexdigest()[:32]
+
+    def _get_reindex_job_id(self, text_chunks: list[dict]) -> str:
+        """Identify a re-index apart from the checkpoint of the original ingest of the same chunks."""
+        return hashlib.sha256(f"reindex:{self._get_ingest_job_id(text_chunks)}".encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def _summarize_ingest(
+        user_id: str, text_chunks: list[dict], responses: list[CreateEmbeddingResponse], chunks_resumed: int
+    ) -> dict[str, Any]:
+        """Describe the stored chunks without echoing their vectors back to the client."""
+        point_ids = [
+            get_point_id(user_id, chunk["document_id"], chunk.get("part"), chunk["chunk_index"])
+            for chunk in text_chunks
+        ]
+
+        return {
+            "status": "success",
+            "document_ids": list(dict.fromkeys(chunk["document_id"] for chunk in text_chunks)),
+            "point_ids": point_ids,
+            "chunks_saved": len(text_chunks) - chunks_resumed,
+            "chunks_resumed": chunks_resumed,
+            "parts": sorted({chunk["part"] for chunk in text_chunks if "part" in chunk}),
+            "usage": {
+                "prompt_tokens": sum(response.usage.prompt_tokens for response in responses),
+                "total_tokens": sum(response.usage.total_tokens for response in responses),
+            },
+        }
+
+
+async def create_text_embeddings(
+    embedding_client: AzureOpenAI, texts: list[str], dimensions: int = None
+) -> CreateEmbeddingResponse:
+    """
+    Embed texts with the configured deployment at the requested output dimension.
+
+    :param embedding_client: Client for creating embeddings.
+    :param texts: Texts to embed.
+    :param dimensions: Output dimension, defaults to `QDRANT_VECTOR_SIZE`.
+    :return: Embedding response whose vectors have exactly `dimensions` components.
+    """
+    dimensions = dimensions or settings.QDRANT_VECTOR_SIZE
+    # Other models, such as text-embedding-ada-002, reject `dimensions` even at their full size
+    options = {"dimensions": dimensions} if settings.AZURE_OPENAI_MODEL_NAME in MATRYOSHKA_EMBEDDING_MODELS else {}
+
+    response = await asyncio.to_thread(
+        embedding_client.embeddings.create,
+        input=texts,
+        model=settings.AZURE_OPENAI_DEPLOYMENT_NAME,
+        **options,
+    )
+
+    if response.data and len(response.data[0].embedding) != dimensions:
+        embeddings = truncate_embeddings([item.embedding for item in response.data], dimensions)
+        for item, embedding in zip(response.data, embeddings):
+            item.embedding = embedding
+
+    return response
+
+
+@lru_cache
+def get_tokenizer():
+    """:return: Tokenizer used to count and split chunk tokens, loaded once per process."""
+    return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+@lru_cache
+def load_text_resources() -> None:
+    """
+    Download the sentence tokenizer data and load both tokenizers into memory.
+
+    Runs once per process, so when the server preloads the application the forked workers inherit them.
+    """
+    if settings.NLTK_DATA_DIR not in nltk.data.path:
+        nltk.data.path.append(settings.NLTK_DATA_DIR)
+
+    try:
+        nltk.data.find("tokenizers/punkt_tab")
+    except LookupError:
+        nltk.download("punkt_tab", download_dir=settings.NLTK_DATA_DIR, quiet=True)
 
-        return cleaned_texts
+    sent_tokenize("Loaded.")
+    get_tokenizer()
 
 
 async def get_text_extractor_service() -> TextExtractorService:
-    """:return: TextExtractorService instance."""
-    return TextExtractorService()
+    """:return: TextExtractorService instance, reporting the tokens saved with the chunking tokenizer."""
+    return TextExtractorService(get_tokenizer())
 
 
 async def get_text_tokenization_service(tokenizer, max_tokens: int = 500) -> SentenceAwareChunker:
@@ -267,13 +582,22 @@ async def get_text_tokenization_service(tokenizer, max_tokens: int = 500) -> Sen
 
 
 async def get_embedding_service(
-    embedding_client, text_extractor: TextExtractorService, tokenizer, max_tokens: int = 500
+    embedding_client,
+    text_extractor: TextExtractorService,
+    tokenizer,
+    max_tokens: int = 500,
+    redis=None,
+    rate_limiter=None,
+    archive: ArchiveStorage = None,
 ) -> CreateEmbeddingService:
     """
     :param embedding_client: Client for creating embeddings.
     :param text_extractor: TextExtractorService instance.
     :param tokenizer: Tokenizer instance.
     :param max_tokens: Maximum number of tokens per chunk.
+    :param redis: Redis connection used for ingest checkpoints, if any.
+    :param rate_limiter: RateLimiter charged with the chunks and tokens of every ingest, if any.
+    :param archive: Storage the uploaded originals are archived to, if any.
     :return: CreateEmbeddingService instance.
     """
-    return CreateEmbeddingService(embedding_client, text_extractor, tokenizer, max_tokens)
+    return CreateEmbeddingService(embedding_client, text_extractor, tokenizer, max_tokens, redis, rate_limiter, archive)
@@ -1,15 +1,147 @@
-from decouple import config
+import hashlib
+import json
 
-from src.clients.azure_openai import blob_service_client
+import numpy as np
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from redis.exceptions import RedisError
 
+from src.core.constants import (
+    IDEMPOTENCY_KEY_AGE,
+    IDEMPOTENCY_PENDING,
+    INGEST_CHECKPOINT_AGE,
+    INGEST_SLOT_AGE,
+    POINT_COUNT_CACHE_AGE,
+    QUERY_VECTOR_CACHE_AGE,
+)
+from src.core.settings import logger, settings
+from src.embedding.vector_db import count_user_embeddings
 
-async def upload_file_to_azure_blob(file_id: str, file_bytes: bytes, file_name: str) -> str:
-    """Upload a file to Azure Blob Storage."""
 
-    container_name = config("CONTAINER_NAME")
-    blob_name = f"{file_id}/{file_name}"
+def truncate_embeddings(embeddings: list[list[float]], dimensions: int) -> list[list[float]]:
+    """
+    Keep the leading `dimensions` components of every embedding and scale them back to unit length.
 
-    blob_client = await blob_service_client.get_blob_client(container_name=container_name, blob_name=blob_name)
-    await blob_client.upload_blob(file_bytes)
+    Matryoshka trained models such as `text-embedding-3-*` return exactly this when `dimensions` is sent.
+    """
 
-    return blob_client.url
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if vectors.shape[1] < dimensions:
+        raise ValueError(f"Embeddings have {vectors.shape[1]} dimensions, {dimensions} requested")
+
+    vectors = vectors[:, :dimensions]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+
+    return vectors.tolist()
+
+
+def get_document_id(content: bytes) -> str:
+    """Derive a stable document id from the document content."""
+
+    return hashlib.sha256(content).hexdigest()[:32]
+
+
+def get_ingest_checkpoints_key(user_id: str) -> str:
+    """Hash of the user's ingest checkpoints, batches done by job id, so they are cleared without a key scan."""
+
+    return f"user:{user_id}:ingest_checkpoints"
+
+
+async def get_ingest_checkpoint(redis, user_id: str, job_id: str) -> int:
+    """Return the number of batches already upserted for an ingest job."""
+
+    batches_done = await redis.hget(get_ingest_checkpoints_key(user_id), job_id)
+    return int(batches_done) if batches_done else 0
+
+
+async def store_ingest_checkpoint(redis, user_id: str, job_id: str, batches_done: int) -> None:
+    key = get_ingest_checkpoints_key(user_id)
+    await redis.hset(key, job_id, batches_done)
+    await redis.expire(key, INGEST_CHECKPOINT_AGE)
+
+
+async def clear_ingest_checkpoint(redis, user_id: str, job_id: str) -> None:
+    await redis.hdel(get_ingest_checkpoints_key(user_id), job_id)
+
+
+async def clear_ingest_checkpoints(redis, user_id: str) -> None:
+    """Forget the ingest checkpoints of a user so deleted documents are fully re-ingested on upload."""
+
+    await redis.delete(get_ingest_checkpoints_key(user_id))
+
+
+async def get_user_point_count(redis, user_id: str) -> int:
+    """Return the number of stored points of a user, cached in Redis between ingests and deletes."""
+
+    key = f"user:{user_id}:points"
+    cached_count = await redis.get(key)
+    if cached_count is not None:
+        return int(cached_count)
+
+    count = await count_user_embeddings(user_id)
+    await redis.set(key, count, ex=POINT_COUNT_CACHE_AGE)
+    return count
+
+
+async def invalidate_user_point_count(redis, user_id: str) -> None:
+    await redis.delete(f"user:{user_id}:points")
+
+
+async def begin_idempotent_request(redis, user_id: str, idempotency_key: str) -> dict | None:
+    """
+    Reserve an idempotency key for the current request.
+
+    The reservation expires with the ingest slot, so a key held by a worker killed mid-request is freed for the
+    retry. Only the completed response is kept for `IDEMPOTENCY_KEY_AGE`.
+
+    :return:
+        - `None` if the key was reserved and the request should be processed.
+        - The stored response if a request with this key has already completed.
+    :raises HTTPException: 409 if a request with this key is still in progress.
+    """
+
+    key = f"user:{user_id}:idempotency:{idempotency_key}"
+    if await redis.set(key, IDEMPOTENCY_PENDING, ex=INGEST_SLOT_AGE, nx=True):
+        return None
+
+    stored_response = await redis.get(key)
+    if stored_response is None or stored_response == IDEMPOTENCY_PENDING:
+        raise HTTPException(status_code=409, detail="A request with this idempotency key is in progress")
+
+    return json.loads(stored_response)
+
+
+async def complete_idempotent_request(redis, user_id: str, idempotency_key: str, response: dict) -> None:
+    key = f"user:{user_id}:idempotency:{idempotency_key}"
+    await redis.set(key, json.dumps(jsonable_encoder(response)), ex=IDEMPOTENCY_KEY_AGE)
+
+
+async def release_idempotent_request(redis, user_id: str, idempotency_key: str) -> None:
+    """Drop the reservation of a failed request so the client can retry it."""
+
+    await redis.delete(f"user:{user_id}:idempotency:{idempotency_key}")
+
+
+def get_query_vector_key(text: str, dimensions: int) -> str:
+    query_hash = hashlib.sha256(f"{settings.AZURE_OPENAI_DEPLOYMENT_NAME}:{dimensions}:{text}".encode("utf-8"))
+    return f"query_vector:{query_hash.hexdigest()}"
+
+
+async def get_cached_query_vector(redis, text: str, dimensions: int) -> list[float] | None:
+    """Return the cached embedding of a search query, treating an unreachable Redis as a cache miss."""
+
+    try:
+        cached_vector = await redis.get(get_query_vector_key(text, dimensions))
+    except RedisError as e:
+        logger.warning(f"Query vector cache unavailable: {str(e)}")
+        return None
+
+    return json.loads(cached_vector) if cached_vector else None
+
+
+async def store_query_vector(redis, text: str, dimensions: int, embedding: list[float]) -> None:
+    try:
+        await redis.set(get_query_vector_key(text, dimensions), json.dumps(embedding), ex=QUERY_VECTOR_CACHE_AGE)
+    except RedisError as e:
+        logger.warning(f"Query vector cache unavailable: {str(e)}")
@@ -1,64 +1,534 @@
+import asyncio
 import uuid
-from typing import Any
+import zlib
+from collections import defaultdict
+from typing import Any, NamedTuple
 
 from qdrant_client import models
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import VectorParams, Distance, PointStruct, Record, ScoredPoint
 
-from src.core.settings import settings
+from src.core.constants import (
+    EMBEDDING_MODEL_DIMENSIONS,
+    MATRYOSHKA_EMBEDDING_MODELS,
+    POINT_ID_NAMESPACE,
+    RETRIEVE_BATCH_SIZE,
+    OPTIMIZER_DELETED_THRESHOLD,
+    OPTIMIZER_VACUUM_MIN_VECTORS,
+    TENANCY_PER_TENANT,
+    TENANCY_SHARD_KEY,
+    TENANCY_SHARED,
+    VECTOR_STORE_LOCAL,
+    VECTOR_STORE_QDRANT,
+)
+from src.core.settings import settings, logger
 from src.clients.qdrant import client
+from src.embedding.local_vector_store import LocalVectorStore
+from src.embedding.vector_store import SearchFilter, VectorStore
 
 
-async def collection_exists() -> bool:
+class TenantLocation(NamedTuple):
+    collection_name: str
+    shard_key: str | None = None
+
+
+class SharedCollectionTenancy:
+    """All tenants share one collection, partitioned by the `user_id` payload index."""
+
+    mode = TENANCY_SHARED
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self.vector_size = None
+
+    async def setup(self, vector_size: int) -> None:
+        self.vector_size = vector_size
+        await _create_collection(self.collection_name, vector_size)
+
+    async def resolve(self, user_id: str) -> TenantLocation:
+        return TenantLocation(self.collection_name)
+
+    async def source_collections(self) -> list[str]:
+        return [self.collection_name]
+
+    def owns_collection(self, collection_name: str) -> bool:
+        """Check if points of this layout may be written to the collection."""
+        return collection_name == self.collection_name
+
+
+class ShardKeyTenancy(SharedCollectionTenancy):
+    """Tenants are hashed into groups and every group lives in its own Qdrant custom shard."""
+
+    mode = TENANCY_SHARD_KEY
+
+    def __init__(self, collection_name: str, tenant_groups: int):
+        super().__init__(collection_name)
+        self.tenant_groups = tenant_groups
+        self._shard_keys = set()
+        self._shard_key_locks = defaultdict(asyncio.Lock)
+
+    async def setup(self, vector_size: int) -> None:
+        self.vector_size = vector_size
+        await _create_collection(self.collection_name, vector_size, sharding_method=models.ShardingMethod.CUSTOM)
+        await self._load_shard_keys()
+
+    async def resolve(self, user_id: str) -> TenantLocation:
+        shard_key = self.get_shard_key(user_id)
+        if shard_key not in self._shard_keys:
+            async with self._shard_key_locks[shard_key]:
+                if shard_key not in self._shard_keys:
+                    await self._create_shard_key(shard_key)
+
+        return TenantLocation(self.collection_name, shard_key)
+
+    async def _create_shard_key(self, shard_key: str) -> None:
+        """Create the shard key, another worker creating it first counts as created."""
+        try:
+            await client.create_shard_key(self.collection_name, shard_key)
+        except Exception:
+            await self._load_shard_keys()
+            if shard_key not in self._shard_keys:
+                raise
+        else:
+            self._shard_keys.add(shard_key)
+
+    async def _load_shard_keys(self) -> None:
+        cluster_info = await client.collection_cluster_info(self.collection_name)
+        for shard in [*cluster_info.local_shards, *cluster_info.remote_shards]:
+            if shard.shard_key is not None:
+                self._shard_keys.add(str(shard.shard_key))
+
+    def get_shard_key(self, user_id: str) -> str:
+        return f"tenant_group_{zlib.crc32(user_id.encode('utf-8')) % self.tenant_groups}"
+
+
+class PerTenantCollectionTenancy(SharedCollectionTenancy):
+    """Every tenant gets its own collection, created lazily on first use."""
+
+    mode = TENANCY_PER_TENANT
+
+    def __init__(self, collection_name: str):
+        super().__init__(collection_name)
+        self._collections = set()
+        self._collection_locks = defaultdict(asyncio.Lock)
+
+    async def setup(self, vector_size: int) -> None:
+        self.vector_size = vector_size
+        self._collections.update(await self._list_prefixed_collections())
+
+    async def resolve(self, user_id: str) -> TenantLocation:
+        collection_name = f"{self.collection_name}_{user_id}"
+        if collection_name not in self._collections:
+            async with self._collection_locks[collection_name]:
+                if collection_name not in self._collections:
+                    await _create_collection(collection_name, self.vector_size or settings.QDRANT_VECTOR_SIZE)
+                    self._collections.add(collection_name)
+
+        return TenantLocation(collection_name)
+
+    async def source_collections(self) -> list[str]:
+        """
+        Tenant collections holding points.
+
+        Other collections sharing the name prefix, such as `<name>_sharded` or `<name>_v2`, are skipped: a tenant
+        collection is named after the `user_id` of its points.
+        """
+        return [name for name in await self._list_prefixed_collections() if await self._is_tenant_collection(name)]
+
+    def owns_collection(self, collection_name: str) -> bool:
+        return collection_name.startswith(f"{self.collection_name}_")
+
+    async def _list_prefixed_collections(self) -> list[str]:
+        response = await client.get_collections()
+        return [c.name for c in response.collections if self.owns_collection(c.name)]
+
+    async def _is_tenant_collection(self, collection_name: str) -> bool:
+        records, _ = await client.scroll(collection_name=collection_name, limit=1, with_payload=["user_id"])
+        return bool(records) and collection_name == f"{self.collection_name}_{records[0].payload.get('user_id')}"
+
+
+def get_tenancy(mode: str, collection_name: str = None) -> SharedCollectionTenancy:
+    """Build the tenancy strategy for the given mode."""
+
+    collection_name = collection_name or settings.QDRANT_COLLECTION_NAME
+    if mode == TENANCY_SHARED:
+        return SharedCollectionTenancy(collection_name)
+    if mode == TENANCY_SHARD_KEY:
+        return ShardKeyTenancy(collection_name, settings.QDRANT_TENANT_GROUPS)
+    if mode == TENANCY_PER_TENANT:
+        return PerTenantCollectionTenancy(collection_name)
+
+    raise ValueError(f"Unknown Qdrant tenancy mode: {mode}")
+
+
+def get_point_id(user_id: str, document_id: str, part: int | None, chunk_index: int) -> str:
+    """Build a deterministic point id from the position of a chunk within a document."""
+
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{user_id}:{document_id}:{part or 0}:{chunk_index}"))
+
+
+async def collection_exists(collection_name: str) -> bool:
     """Check if the collection exists in Qdrant."""
 
-    return await client.collection_exists(settings.QDRANT_COLLECTION_NAME)
+    return await client.collection_exists(collection_name)
 
 
-async def create_collection(vector_size: int) -> None:
-    """Create a collection in Qdrant if it does not exist."""
+async def _create_collection(collection_name: str, vector_size: int, sharding_method=None) -> None:
+    """
+    Create a collection in Qdrant if it does not exist.
 
-    if await collection_exists():
-        return
+    Gunicorn workers and concurrent tenant requests may create the same collection at once, a collection
+    created by another caller in the meantime counts as created.
 
-    await client.create_collection(
-        collection_name=settings.QDRANT_COLLECTION_NAME,
-        vectors_config=VectorParams(
-            size=vector_size,
-            distance=Distance.COSINE,
-        ),
+    Collections vacuum segments once a small share of their points is deleted, so Qdrant reclaims the space
+    of deleted embeddings on its own. Existing collections get the same thresholds at startup.
+    """
+    optimizers_config = models.OptimizersConfigDiff(
+        deleted_threshold=OPTIMIZER_DELETED_THRESHOLD,
+        vacuum_min_vector_number=OPTIMIZER_VACUUM_MIN_VECTORS,
     )
 
+    if not await collection_exists(collection_name):
+        logger.info(f"Creating Qdrant collection {collection_name}")
+        try:
+            await client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(
+                    size=vector_size,
+                    distance=Distance.COSINE,
+                ),
+                sharding_method=sharding_method,
+                optimizers_config=optimizers_config,
+            )
+        except Exception:
+            if not await collection_exists(collection_name):
+                raise
+            logger.info(f"Qdrant collection {collection_name} was created concurrently")
 
-async def add_embedding(vector: list[float], payload: dict[str, Any]) -> None:
-    """Add an embedding to the Qdrant collection."""
+    collection = await client.get_collection(collection_name)
+    stored_size = collection.config.params.vectors.size
+    if stored_size != vector_size:
+        raise ValueError(
+            f"Collection {collection_name} stores {stored_size} dimensional vectors, "
+            f"but QDRANT_VECTOR_SIZE is {vector_size}. Use a new collection or re-index the existing one."
+        )
 
-    point_id = str(uuid.uuid4())
-    point = PointStruct(id=point_id, vector=vector, payload=payload)
-    await client.upsert(collection_name=settings.QDRANT_COLLECTION_NAME, points=[point])
+    stored_optimizers = collection.config.optimizer_config
+    if (stored_optimizers.deleted_threshold, stored_optimizers.vacuum_min_vector_number) != (
+        OPTIMIZER_DELETED_THRESHOLD,
+        OPTIMIZER_VACUUM_MIN_VECTORS,
+    ):
+        logger.info(f"Updating the vacuum thresholds of Qdrant collection {collection_name}")
+        await client.update_collection(collection_name=collection_name, optimizers_config=optimizers_config)
 
+    await create_payload_indexes(collection_name)
 
-async def search_similar(vector: list[float], limit: int = 5):
-    """Search for similar embeddings in the Qdrant collection."""
 
-    search_result = await client.search(
-        collection_name=settings.QDRANT_COLLECTION_NAME,
-        query_vector=vector,
-        limit=limit,
-        with_payload=True,
-    )
+async def create_payload_indexes(collection_name: str) -> None:
+    """Index the payload fields used by user scoped filters, search filters and deletes."""
 
-    return search_result
+    indexes = {
+        "user_id": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+        "document_id": models.PayloadSchemaType.KEYWORD,
+        "created_at": models.PayloadSchemaType.FLOAT,
+        "filename": models.PayloadSchemaType.KEYWORD,
+        "mime_type": models.PayloadSchemaType.KEYWORD,
+        "page": models.PayloadSchemaType.INTEGER,
+    }
+    for field_name, field_schema in indexes.items():
+        await client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=field_schema,
+        )
 
 
-async def get_all_user_embeddings(user_id: str, limit: int = 50) -> list[PointStruct]:
-    points = await client.scroll(
-        collection_name=settings.QDRANT_COLLECTION_NAME,
-        scroll_filter=models.Filter(
-            must=[models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id))]
-        ),
-        limit=limit,
-        with_payload=True,
-        with_vectors=False,
-    )
+def _user_filter(
+    user_id: str, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None
+) -> models.Filter:
+    conditions = [models.FieldCondition(key="user_id", match=models.MatchValue(value=user_id))]
+
+    if document_id:
+        conditions.append(models.FieldCondition(key="document_id", match=models.MatchValue(value=document_id)))
+
+    if created_before is not None:
+        conditions.append(models.FieldCondition(key="created_at", range=models.Range(lt=created_before)))
+
+    excluded = [models.HasIdCondition(has_id=keep_point_ids)] if keep_point_ids else None
+    return models.Filter(must=conditions, must_not=excluded)
+
+
+def _search_filter(user_id: str, search_filter: SearchFilter = None) -> models.Filter:
+    query_filter = _user_filter(user_id)
+    if search_filter is None:
+        return query_filter
+
+    if search_filter.document_ids:
+        query_filter.must.append(
+            models.FieldCondition(key="document_id", match=models.MatchAny(any=list(search_filter.document_ids)))
+        )
+
+    if search_filter.page_from is not None or search_filter.page_to is not None:
+        query_filter.must.append(
+            models.FieldCondition(
+                key="page", range=models.Range(gte=search_filter.page_from, lte=search_filter.page_to)
+            )
+        )
+
+    if search_filter.created_from is not None or search_filter.created_to is not None:
+        query_filter.must.append(
+            models.FieldCondition(
+                key="created_at", range=models.Range(gte=search_filter.created_from, lte=search_filter.created_to)
+            )
+        )
+
+    return query_filter
+
+
+class QdrantVectorStore(VectorStore):
+    """Stores the points in Qdrant, laid out according to the tenancy strategy."""
+
+    def __init__(self, tenancy: SharedCollectionTenancy):
+        self.tenancy = tenancy
+
+    async def create_collection(self, vector_size: int) -> None:
+        await self.tenancy.setup(vector_size)
+
+    async def add_embeddings(self, user_id: str, points: list[PointStruct]) -> None:
+        location = await self.tenancy.resolve(user_id)
+        await client.upsert(
+            collection_name=location.collection_name,
+            points=points,
+            shard_key_selector=location.shard_key,
+            wait=True,
+        )
+
+    async def search_similar(
+        self, user_id: str, vector: list[float], limit: int = 5, search_filter: SearchFilter = None
+    ) -> list[ScoredPoint]:
+        location = await self.tenancy.resolve(user_id)
+        return await client.search(
+            collection_name=location.collection_name,
+            query_vector=vector,
+            query_filter=_search_filter(user_id, search_filter),
+            limit=limit,
+            with_payload=True,
+            shard_key_selector=location.shard_key,
+        )
+
+    async def retrieve_points(self, user_id: str, point_ids: list[str], with_vectors: bool = False) -> list[Record]:
+        location = await self.tenancy.resolve(user_id)
+        points = []
+        for start in range(0, len(point_ids), RETRIEVE_BATCH_SIZE):
+            batch = await client.retrieve(
+                collection_name=location.collection_name,
+                ids=point_ids[start : start + RETRIEVE_BATCH_SIZE],
+                with_payload=True,
+                with_vectors=with_vectors,
+                shard_key_selector=location.shard_key,
+            )
+            points.extend([point for point in batch if point.payload.get("user_id") == user_id])
+
+        return points
+
+    async def get_all_user_embeddings(self, user_id: str, limit: int = 50) -> tuple[list[Record], Any]:
+        location = await self.tenancy.resolve(user_id)
+        return await client.scroll(
+            collection_name=location.collection_name,
+            scroll_filter=_user_filter(user_id),
+            limit=limit,
+            with_payload=True,
+            with_vectors=False,
+            shard_key_selector=location.shard_key,
+        )
+
+    async def count_user_embeddings(self, user_id: str, document_id: str = None, created_before: float = None) -> int:
+        location = await self.tenancy.resolve(user_id)
+        result = await client.count(
+            collection_name=location.collection_name,
+            count_filter=_user_filter(user_id, document_id, created_before),
+            exact=True,
+            shard_key_selector=location.shard_key,
+        )
+
+        return result.count
+
+    async def delete_user_embeddings(
+        self, user_id: str, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None
+    ) -> int:
+        location = await self.tenancy.resolve(user_id)
+        delete_filter = _user_filter(user_id, document_id, created_before, keep_point_ids)
+        result = await client.count(
+            collection_name=location.collection_name,
+            count_filter=delete_filter,
+            exact=True,
+            shard_key_selector=location.shard_key,
+        )
+        deleted = result.count
+        if not deleted:
+            return 0
+
+        await client.delete(
+            collection_name=location.collection_name,
+            points_selector=models.FilterSelector(filter=delete_filter),
+            shard_key_selector=location.shard_key,
+            wait=True,
+        )
+
+        return deleted
+
+    async def ping(self) -> None:
+        await client.get_collections()
+
+    async def close(self) -> None:
+        await client.close()
+
+
+def get_vector_store(backend: str) -> VectorStore:
+    """Build the vector store for the configured backend."""
+
+    if backend == VECTOR_STORE_QDRANT:
+        return QdrantVectorStore(get_tenancy(settings.QDRANT_TENANCY_MODE))
+    if backend == VECTOR_STORE_LOCAL:
+        return LocalVectorStore(
+            settings.LOCAL_VECTOR_STORE_PATH,
+            ivf_lists=settings.LOCAL_VECTOR_STORE_IVF_LISTS,
+            ivf_probes=settings.LOCAL_VECTOR_STORE_IVF_PROBES,
+            ivf_min_points=settings.LOCAL_VECTOR_STORE_IVF_MIN_POINTS,
+        )
+
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+vector_store = get_vector_store(settings.VECTOR_STORE_BACKEND)
+
+
+async def create_collection(vector_size: int) -> None:
+    """Prepare the vector store for embeddings of the given dimension."""
+
+    validate_vector_size(vector_size)
+    await vector_store.create_collection(vector_size)
+
+
+def validate_vector_size(vector_size: int) -> None:
+    """Check that the configured model can produce embeddings of the given dimension."""
+
+    model_name = settings.AZURE_OPENAI_MODEL_NAME
+    max_dimensions = EMBEDDING_MODEL_DIMENSIONS.get(model_name)
+    if vector_size <= 0 or (max_dimensions and vector_size > max_dimensions):
+        raise ValueError(
+            f"QDRANT_VECTOR_SIZE={vector_size} is not supported by {model_name}, "
+            f"expected a value between 1 and {max_dimensions}"
+        )
+
+    # Truncated embeddings of other models would silently lose most of their meaning
+    if max_dimensions and model_name not in MATRYOSHKA_EMBEDDING_MODELS and vector_size != max_dimensions:
+        raise ValueError(
+            f"QDRANT_VECTOR_SIZE={vector_size} is not supported by {model_name}, its embeddings cannot be "
+            f"shortened, expected {max_dimensions}"
+        )
+
+
+async def ping_vector_store() -> None:
+    await vector_store.ping()
+
+
+async def close_vector_store() -> None:
+    await vector_store.close()
+
+
+async def add_embeddings(user_id: str, points: list[PointStruct]) -> None:
+    """Upsert a batch of embeddings of a user in a single request."""
+
+    await vector_store.add_embeddings(user_id, points)
+
+
+async def search_similar(
+    user_id: str, vector: list[float], limit: int = 5, search_filter: SearchFilter = None
+) -> list[ScoredPoint]:
+    """Search for similar embeddings among the points of a user, narrowed by the optional filter."""
+
+    return await vector_store.search_similar(user_id, vector, limit, search_filter)
+
+
+async def get_chunk_context(user_id: str, search_result: list, window: int) -> dict[str, list[dict[str, Any]]]:
+    """
+    Fetch the neighboring chunks of every search hit with a single batched retrieve.
+
+    :param user_id: Owner of the searched points.
+    :param search_result: Scored points returned by `search_similar`.
+    :param window: Number of chunks to fetch on each side of a hit within the same part.
+    :return: Mapping of hit id to its neighbors ordered by `chunk_index`.
+    """
+
+    if window <= 0 or not search_result:
+        return {}
+
+    neighbor_ids = {}
+    for hit in search_result:
+        payload = hit.payload or {}
+        if "document_id" not in payload or "chunk_index" not in payload:
+            continue
+
+        chunk_index = payload["chunk_index"]
+        for index in range(max(chunk_index - window, 0), chunk_index + window + 1):
+            if index == chunk_index:
+                continue
+            point_id = get_point_id(user_id, payload["document_id"], payload.get("part"), index)
+            neighbor_ids.setdefault(point_id, []).append(str(hit.id))
+
+    if not neighbor_ids:
+        return {}
+
+    points = await vector_store.retrieve_points(user_id, list(neighbor_ids))
+
+    context = {str(hit.id): [] for hit in search_result}
+    for point in points:
+        neighbor = {"id": point.id, "chunk_index": point.payload.get("chunk_index"), "text": point.payload.get("text")}
+        for hit_id in neighbor_ids.get(str(point.id), []):
+            context[hit_id].append(neighbor)
+
+    for neighbors in context.values():
+        neighbors.sort(key=lambda n: n["chunk_index"])
+
+    return context
+
+
+async def get_point_vectors(user_id: str, point_ids: list[str]) -> list[list[float]]:
+    """Fetch the vectors of the given points of a user, in the order of `point_ids`."""
+
+    points = await vector_store.retrieve_points(user_id, point_ids, with_vectors=True)
+    vectors = {str(point.id): point.vector for point in points}
+
+    return [vectors[point_id] for point_id in point_ids if point_id in vectors]
+
+
+async def get_all_user_embeddings(user_id: str, limit: int = 50) -> tuple[list[Record], Any]:
+    return await vector_store.get_all_user_embeddings(user_id, limit)
+
+
+async def count_user_embeddings(user_id: str, document_id: str = None, created_before: float = None) -> int:
+    """Count the points of a user, optionally narrowed to a document or to points older than a timestamp."""
+
+    return await vector_store.count_user_embeddings(user_id, document_id, created_before)
+
+
+async def delete_user_embeddings(
+    user_id: str, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None
+) -> int:
+    """
+    Delete the points of a user matching the given filter.
+
+    :param user_id: Owner of the points.
+    :param document_id: Restrict the delete to a single document.
+    :param created_before: Restrict the delete to points created before this UNIX timestamp.
+    :param keep_point_ids: Points never deleted, even when they match the filter.
+    :return: Number of deleted points.
+    """
+
+    return await vector_store.delete_user_embeddings(user_id, document_id, created_before, keep_point_ids)
+
+
+async def optimize_collection(user_id: str) -> None:
+    """Reclaim the space left by deleted points of a user."""
 
-    return points
+    await vector_store.optimize_collection(user_id)
@@ -0,0 +1,64 @@
+from abc import ABC, abstractmethod
+from typing import Any, NamedTuple
+
+from qdrant_client.models import PointStruct, Record, ScoredPoint
+
+
+class SearchFilter(NamedTuple):
+    """Conditions a search hit must meet besides belonging to the user, combined with AND. Ranges are inclusive."""
+
+    document_ids: tuple[str, ...] = ()
+    page_from: int | None = None
+    page_to: int | None = None
+    created_from: float | None = None
+    created_to: float | None = None
+
+
+class VectorStore(ABC):
+    """
+    Storage and similarity search for the chunk embeddings of every user.
+
+    Implementations keep the points of each user apart and only ever return points owned by the given user.
+    Points are exchanged as `qdrant_client` models so every backend returns the same shapes to the routers.
+    """
+
+    @abstractmethod
+    async def create_collection(self, vector_size: int) -> None:
+        """Prepare the storage for vectors of the given dimension."""
+
+    @abstractmethod
+    async def add_embeddings(self, user_id: str, points: list[PointStruct]) -> None:
+        """Insert the points of a user, replacing the ones that already exist."""
+
+    @abstractmethod
+    async def search_similar(
+        self, user_id: str, vector: list[float], limit: int = 5, search_filter: SearchFilter = None
+    ) -> list[ScoredPoint]:
+        """Return the `limit` points of a user matching `search_filter` closest to `vector` by cosine similarity."""
+
+    @abstractmethod
+    async def retrieve_points(self, user_id: str, point_ids: list[str], with_vectors: bool = False) -> list[Record]:
+        """Fetch points of a user by id, silently skipping the ones that do not exist."""
+
+    @abstractmethod
+    async def get_all_user_embeddings(self, user_id: str, limit: int = 50) -> tuple[list[Record], Any]:
+        """Return the first `limit` points of a user and the offset of the next page."""
+
+    @abstractmethod
+    async def count_user_embeddings(self, user_id: str, document_id: str = None, created_before: float = None) -> int:
+        """Count the points of a user, optionally narrowed to a document or to points older than a timestamp."""
+
+    @abstractmethod
+    async def delete_user_embeddings(
+        self, user_id: str, document_id: str = None, created_before: float = None, keep_point_ids: list[str] = None
+    ) -> int:
+        """Delete the points of a user matching the filter, except `keep_point_ids`, and return how many."""
+
+    async def optimize_collection(self, user_id: str) -> None:
+        """Reclaim the space left by deleted points of a user, stores vacuuming on their own do nothing."""
+
+    async def ping(self) -> None:
+        """Check that the store is reachable, raising when it is not."""
+
+    async def close(self) -> None:
+        """Release the connections and files held by the store."""
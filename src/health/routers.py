@@ -0,0 +1,55 @@
+import asyncio
+
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
+from starlette.status import HTTP_200_OK, HTTP_503_SERVICE_UNAVAILABLE
+
+from src.core.settings import get_redis, logger, settings
+from src.database.engine.config import engine
+from src.embedding.vector_db import ping_vector_store
+
+router = APIRouter()
+
+
+@router.get("/live")
+async def liveness_router() -> dict:
+    """Report that the worker process is up and serving requests."""
+
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+async def readiness_router() -> ORJSONResponse:
+    """Report whether the vector store, Redis and Postgres are reachable, with 503 when any of them is not."""
+
+    names = ["vector_store", "redis", "postgres"]
+    results = await asyncio.gather(
+        *[_check(name, check) for name, check in zip(names, [ping_vector_store, _ping_redis, _ping_postgres])]
+    )
+
+    checks = dict(zip(names, results))
+    is_ready = all(result == "ok" for result in results)
+    return ORJSONResponse(
+        status_code=HTTP_200_OK if is_ready else HTTP_503_SERVICE_UNAVAILABLE,
+        content={"status": "ok" if is_ready else "unavailable", "checks": checks},
+    )
+
+
+async def _check(name: str, check) -> str:
+    try:
+        await asyncio.wait_for(check(), timeout=settings.HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Readiness check {name} failed: {str(e) or type(e).__name__}")
+        return "unavailable"
+
+    return "ok"
+
+
+async def _ping_redis() -> None:
+    await get_redis().ping()
+
+
+async def _ping_postgres() -> None:
+    async with engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))